@@ -0,0 +1,47 @@
+import logging
+from typing import Optional
+
+from lib.depcont import DepContainer
+from lib.disk_cache import DiskBlobCache
+from lib.utils import async_wrap
+from models.models import RenderedAvatar
+
+
+class AvatarResultCache:
+    """
+    Rendered avatars by the source photo's file_unique_id and the frame template version.
+    Redis keeps the Telegram file_id of the sent document, the disk tier keeps the rendered bytes.
+    """
+
+    KEY_PREFIX = 'avatar:result'
+
+    def __init__(self, deps: DepContainer, disk: Optional[DiskBlobCache] = None, ttl=30 * 24 * 60 * 60):
+        self.deps = deps
+        self.disk = disk
+        self.ttl = ttl
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def key(self, unique_id, template_version):
+        return f'{self.KEY_PREFIX}:{template_version}:{unique_id}'
+
+    async def get(self, unique_id, template_version) -> RenderedAvatar:
+        r = await self.deps.db.get_redis()
+        data = await r.get(self.key(unique_id, template_version))
+        try:
+            return RenderedAvatar.from_json(data) if data else RenderedAvatar()
+        except (TypeError, ValueError):
+            return RenderedAvatar()
+
+    async def put(self, unique_id, template_version, record: RenderedAvatar):
+        r = await self.deps.db.get_redis()
+        await r.set(self.key(unique_id, template_version), record.to_json(), expire=self.ttl)
+
+    # the disk tier reads, writes and evicts files: keep it off the event loop (DiskBlobCache is thread-safe)
+
+    async def load_bytes(self, record: RenderedAvatar) -> Optional[bytes]:
+        if self.disk is None or not record.digest:
+            return None
+        return await async_wrap(self.disk.get)(record.digest)
+
+    async def store_bytes(self, data: bytes):
+        return await async_wrap(self.disk.put)(data) if self.disk is not None else ''
@@ -1,36 +1,362 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import warnings
+from collections import OrderedDict, namedtuple
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from functools import lru_cache
 from io import BytesIO
+from typing import List, Optional, Dict, Union
 
-from PIL import Image
+import numpy as np
+from PIL import Image, GifImagePlugin, ImageSequence
 from aiogram.types import PhotoSize, User
 
 from lib.config import Config
 from lib.utils import async_wrap
 
 
-def img_to_bio(image, name):
-    bio = BytesIO()
+OUTPUT_FORMATS = ('png', 'png_optimized', 'jpeg', 'webp')
+
+EncodedImage = namedtuple('EncodedImage', ('data', 'encode_time'))
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    format: str = 'png'  # see OUTPUT_FORMATS
+    compress_level: int = 6  # png: 0 (fast, big) .. 9 (slow, small)
+    quality: int = 92  # jpeg, webp
+
+    @classmethod
+    def from_config(cls, cfg) -> 'OutputFormat':
+        cfg = cfg or {}
+        output = cls(format=str(cfg.get('format', cls.format)).lower(),
+                     compress_level=int(cfg.get('compress_level', cls.compress_level)),
+                     quality=int(cfg.get('quality', cls.quality)))
+        if output.format not in OUTPUT_FORMATS:
+            raise ValueError(f'unknown output format {output.format!r}, must be one of {OUTPUT_FORMATS}')
+        return output
+
+    @property
+    def extension(self):
+        return {'jpeg': 'jpg', 'webp': 'webp'}.get(self.format, 'png')
+
+    def encode(self, image: Image.Image) -> EncodedImage:
+        t0 = time.perf_counter()
+        bio = BytesIO()
+        if self.format == 'png':
+            image.save(bio, 'PNG', compress_level=self.compress_level)
+        elif self.format == 'png_optimized':
+            image.save(bio, 'PNG', optimize=True)
+        elif self.format == 'jpeg':
+            image.convert('RGB').save(bio, 'JPEG', quality=self.quality, subsampling=0, optimize=True)
+        elif self.format == 'webp':
+            image.save(bio, 'WEBP', quality=self.quality, method=4)
+        else:
+            raise ValueError(f'unknown output format {self.format!r}')
+        return EncodedImage(bio.getvalue(), time.perf_counter() - t0)
+
+
+def img_to_bio(image, name, output: OutputFormat = OutputFormat()):
+    bio = BytesIO(output.encode(image).data)
     bio.name = name
-    image.save(bio, 'PNG')
-    bio.seek(0)
     return bio
 
 
-async def download_tg_photo(photo: PhotoSize) -> Image.Image:
-    photo_raw = BytesIO()
-    await photo.download(destination=photo_raw)
-    return Image.open(photo_raw)
+SPOOL_THRESHOLD = 1024 * 1024  # bigger downloads go to a temp file instead of RAM
+
+PhotoSource = Union[bytes, str]  # raw file contents or a path to the file
+
+
+class AdmissionError(Exception):
+    pass
+
+
+class InvalidPhoto(AdmissionError):
+    pass
+
+
+class PhotoFileTooBig(AdmissionError):
+    pass
+
+
+class PhotoSizeOutOfRange(AdmissionError):
+    pass
+
+
+@dataclass(frozen=True)
+class AdmissionLimits:
+    max_file_size: int = 10 * 1024 * 1024  # bytes, checked before and during the download
+    min_side: int = 64
+    max_side: int = 4096
+    max_pixels: int = 4096 * 4096  # width * height from the header, checked before decoding
+
+    @classmethod
+    def from_config(cls, cfg) -> 'AdmissionLimits':
+        cfg = cfg.get('avatar', {}).get('admission', {})
+        return cls(max_file_size=int(float(cfg.get('max_file_size_mb', cls.max_file_size / 1024 / 1024))
+                                     * 1024 * 1024),
+                   min_side=int(cfg.get('min_side', cls.min_side)),
+                   max_side=int(cfg.get('max_side', cls.max_side)),
+                   max_pixels=int(cfg.get('max_pixels', cls.max_pixels)))
+
+    def check_file_size(self, file_size):
+        if file_size and file_size > self.max_file_size:
+            raise PhotoFileTooBig(f'file size {file_size} > {self.max_file_size}')
+
+    def check_dimensions(self, w, h):
+        if not w or not h:
+            raise InvalidPhoto('not an image')
+        if not (self.min_side <= w <= self.max_side and self.min_side <= h <= self.max_side):
+            raise PhotoSizeOutOfRange(f'{w}x{h} is out of {self.min_side}..{self.max_side}')
+        if w * h > self.max_pixels:
+            raise PhotoSizeOutOfRange(f'{w}x{h} has more than {self.max_pixels} pixels')
+
+
+class CappedWriter(io.RawIOBase):
+    """
+    File-like wrapper that aborts a streamed download as soon as more than max_bytes are written
+    """
+
+    def __init__(self, target, max_bytes):
+        super().__init__()
+        self.target = target
+        self.max_bytes = max_bytes
+        self.written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.written += len(data)
+        if self.written > self.max_bytes:
+            raise PhotoFileTooBig(f'download exceeded {self.max_bytes} bytes')
+        return self.target.write(data)
 
+    def flush(self):
+        self.target.flush()
 
-async def get_userpic(user: User) -> Image.Image:
+    # aiogram's download(seek=True) rewinds the destination after the last chunk
+    def seekable(self):
+        return self.target.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.target.seek(offset, whence)
+
+    def tell(self):
+        return self.target.tell()
+
+
+@asynccontextmanager
+async def downloaded_photo(photo: PhotoSize, spool_threshold=SPOOL_THRESHOLD,
+                           limits: AdmissionLimits = AdmissionLimits()):
+    """
+    Streams the photo from Telegram and yields a PhotoSource: bytes for small files, a temp file path for big ones.
+    The temp file is removed on exit. Nothing is decoded here, but the header is checked against the limits.
+    :raises AdmissionError: if the file or the picture is too big or it is not a picture at all
+    """
+    limits.check_file_size(photo.file_size)
+
+    if (photo.file_size or 0) <= spool_threshold:
+        photo_raw = BytesIO()
+        await photo.download(destination=CappedWriter(photo_raw, limits.max_file_size))
+        source = photo_raw.getvalue()
+        limits.check_dimensions(*probe_photo_size(source))
+        yield source
+    else:
+        fd, path = tempfile.mkstemp(prefix='alpha_ava_', suffix='.img')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                await photo.download(destination=CappedWriter(f, limits.max_file_size))
+            limits.check_dimensions(*probe_photo_size(path))
+            yield path
+        finally:
+            os.remove(path)
+
+
+def open_photo(source: PhotoSource) -> Image.Image:
+    return Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def probe_photo_size(source: PhotoSource):
+    """
+    (width, height) from the image header, pixel data is not decoded; (0, 0) if it is not an image
+    :raises PhotoSizeOutOfRange: if PIL considers it a decompression bomb
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with open_photo(source) as im:
+                return im.size
+    except Image.DecompressionBombError as e:
+        raise PhotoSizeOutOfRange(str(e))
+    except (IOError, SyntaxError):
+        return 0, 0
+
+
+def choose_photo_size(sizes: List[PhotoSize], target_size) -> Optional[PhotoSize]:
+    """
+    The smallest PhotoSize that still covers target_size after the square crop, or the biggest one available
+    """
+    if not sizes:
+        return None
+    sizes = sorted(sizes, key=lambda s: min(s.width, s.height))
+    return next((s for s in sizes if min(s.width, s.height) >= target_size), sizes[-1])
+
+
+def smallest_photo_size(sizes: List[PhotoSize]) -> Optional[PhotoSize]:
+    return min(sizes, key=lambda s: s.width * s.height, default=None)
+
+
+async def get_userpic_sizes(user: User) -> List[PhotoSize]:
     pics = await user.get_profile_photos(0, 1)
     if pics.photos and pics.photos[0]:
-        first_pic: PhotoSize = pics.photos[0][0]
-        return await download_tg_photo(first_pic)
+        return pics.photos[0]
+    return []
+
+
+async def get_userpic(user: User, target_size) -> Optional[PhotoSize]:
+    return choose_photo_size(await get_userpic_sizes(user), target_size)
 
 
 ALPHA_AVA_LOGO_PATH = './data/alpha-logo.png'
 ALPHA_FULL_BG_PATH = './data/alpha-avatar-v5.png'
 
+STANDARD_PHOTO_SIZES = (160, 320, 640, 1280)  # typical Telegram PhotoSize sides
+DEFAULT_TARGET_SIZE = 640
+
+TEMPLATE_REVISION = 1  # bump it when the rendering code changes the output
+DEFAULT_TEMPLATE = 'v5'
+
+
+@dataclass(frozen=True)
+class FrameTemplate:
+    name: str
+    frame: str  # path to the RGBA overlay
+    output: OutputFormat = OutputFormat()
+
+
+def parse_templates(cfg) -> Dict[str, FrameTemplate]:
+    """
+    avatar.templates from the config: {name: {frame: path, output: {format, compress_level, quality}}}
+    """
+    templates_cfg = cfg.get('avatar', {}).get('templates') or {
+        DEFAULT_TEMPLATE: {'frame': ALPHA_FULL_BG_PATH}
+    }
+    return {
+        name: FrameTemplate(name, t.get('frame', ALPHA_FULL_BG_PATH), OutputFormat.from_config(t.get('output')))
+        for name, t in templates_cfg.items()
+    }
+
+
+def default_template(cfg) -> FrameTemplate:
+    templates = parse_templates(cfg)
+    name = cfg.get('avatar', {}).get('template', DEFAULT_TEMPLATE)
+    return templates.get(name) or next(iter(templates.values()))
+
+
+@lru_cache(maxsize=None)
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:10]
+
+
+def frame_template_version(template: FrameTemplate, target_size=DEFAULT_TARGET_SIZE):
+    output = template.output
+    return f'{TEMPLATE_REVISION}-{_file_hash(template.frame)}-{target_size}-' \
+           f'{output.format}{output.compress_level}q{output.quality}'
+
+
+class OverlayCache:
+    """
+    Process-wide cache of frame overlays.
+    Every asset is decoded once; resized RGBA variants are kept in a bounded LRU keyed by (path, size).
+    Returned images are shared, so never modify them in place!
+    """
+
+    def __init__(self, max_variants=32):
+        self.max_variants = max_variants
+        self.hits = 0
+        self.misses = 0
+        self._sources = {}
+        self._variants = OrderedDict()
+        self._lock = threading.Lock()
+
+    def source(self, path) -> Image.Image:
+        with self._lock:
+            image = self._sources.get(path)
+        if image is None:
+            with Image.open(path) as f:
+                image = f.convert('RGBA')
+            with self._lock:
+                image = self._sources.setdefault(path, image)
+        return image
+
+    def get(self, path, size) -> Image.Image:
+        key = (path, tuple(size))
+        with self._lock:
+            variant = self._variants.get(key)
+            if variant is not None:
+                self._variants.move_to_end(key)
+                self.hits += 1
+                return variant
+            self.misses += 1
+
+        variant = self.source(path).resize(key[1])
+
+        self._put(key, variant)
+        return variant
+
+    def get_premultiplied(self, path, size):
+        """
+        (premultiplied RGBA as uint16, 255 - alpha as uint8) arrays of the overlay resized to "size"
+        """
+        key = (path, tuple(size), 'premultiplied')
+        with self._lock:
+            arrays = self._variants.get(key)
+            if arrays is not None:
+                self._variants.move_to_end(key)
+                self.hits += 1
+                return arrays
+
+        overlay = np.asarray(self.get(path, size), dtype=np.uint16)
+        alpha = overlay[:, :, 3:4]
+        arrays = overlay * alpha, (255 - alpha).astype(np.uint8)
+
+        self._put(key, arrays)
+        return arrays
+
+    def _put(self, key, value):
+        with self._lock:
+            self._variants[key] = value
+            self._variants.move_to_end(key)
+            while len(self._variants) > self.max_variants:
+                self._variants.popitem(last=False)
+
+    def preload(self, paths, sizes=()):
+        for path in paths:
+            self.source(path)
+            for side in sizes:
+                self.get(path, (side, side))
+
+    def clear(self):
+        with self._lock:
+            self._sources.clear()
+            self._variants.clear()
+            self.hits = self.misses = 0
+
+
+overlay_cache = OverlayCache()
+
+
+def warm_up_overlays(frame_paths=(ALPHA_FULL_BG_PATH,)):
+    overlay_cache.preload(frame_paths, STANDARD_PHOTO_SIZES)
+    overlay_cache.preload([ALPHA_AVA_LOGO_PATH])
+
 
 def image_square_crop(im):
     width, height = im.size  # Get dimensions
@@ -56,7 +382,6 @@ def combine_frame_and_photo(cfg: Config, photo: Image.Image):
     photo = image_square_crop(photo)
 
     photo_w, photo_h = photo.size
-    logo = Image.open(ALPHA_AVA_LOGO_PATH)
 
     logo_pos_px = float(cfg.avatar.position.x)
     logo_pos_py = float(cfg.avatar.position.y)
@@ -69,22 +394,150 @@ def combine_frame_and_photo(cfg: Config, photo: Image.Image):
     logo_pos_x = int(logo_pos_px * photo_w / 100.0 - logo_size / 2)
     logo_pos_y = int(logo_pos_py * photo_h / 100.0 - logo_size / 2)
 
-    logo = logo.resize((logo_size, logo_size)).convert('RGBA')
+    logo = overlay_cache.get(ALPHA_AVA_LOGO_PATH, (logo_size, logo_size))
 
     photo.paste(logo, (logo_pos_x, logo_pos_y), mask=logo)
 
     return photo
 
 
-@async_wrap
-def combine_frame_and_photo_v2(cfg: Config, photo: Image.Image):
+COMPOSITING_PIL = 'pil'
+COMPOSITING_NUMPY = 'numpy'
+COMPOSITING_BACKENDS = (COMPOSITING_PIL, COMPOSITING_NUMPY)
+DEFAULT_COMPOSITING = COMPOSITING_PIL  # see tools/bench_avatar.py: paste() is faster for all sizes we measured
+
+
+def blend_premultiplied(photo: Image.Image, premultiplied, inv_alpha) -> Image.Image:
+    """
+    Same result as photo.paste(overlay, mask=overlay) in a single vectorized pass.
+    Uses the rounding of PIL: (x + 128 + ((x + 128) >> 8)) >> 8 is x / 255 rounded.
+    Everything fits uint16: photo * (255 - a) + overlay * a <= 255 * 255.
+    """
+    if photo.mode not in ('RGB', 'RGBA'):
+        photo = photo.convert('RGB')
+    channels = len(photo.mode)
+
+    tmp = np.asarray(photo).astype(np.uint16)
+    tmp *= inv_alpha
+    tmp += premultiplied[:, :, :channels]
+    tmp += 128
+    tmp += tmp >> 8
+    tmp >>= 8
+    return Image.fromarray(tmp.astype(np.uint8), photo.mode)
+
+
+def prepare_photo(photo: Image.Image, size=None) -> Image.Image:
     photo = image_square_crop(photo)
+    if size and photo.size != (size, size):
+        photo = photo.resize((size, size), Image.LANCZOS)
+    return photo
+
 
+def composite_frame(photo: Image.Image, frame_path, compositing=COMPOSITING_PIL) -> Image.Image:
+    """
+    Puts the frame over a square photo. The PIL backend modifies the photo in place!
+    """
     photo_w, photo_h = photo.size
-    logo = Image.open(ALPHA_FULL_BG_PATH)
 
-    logo = logo.resize((photo_w, photo_w)).convert('RGBA')
+    if compositing == COMPOSITING_NUMPY:
+        premultiplied, inv_alpha = overlay_cache.get_premultiplied(frame_path, (photo_w, photo_w))
+        return blend_premultiplied(photo, premultiplied, inv_alpha)
+
+    logo = overlay_cache.get(frame_path, (photo_w, photo_w))
 
     photo.paste(logo, (0, 0), mask=logo)
 
     return photo
+
+
+def combine_frame_and_photo_v2(photo: Image.Image, size=None, frame_path=ALPHA_FULL_BG_PATH,
+                               compositing=COMPOSITING_PIL):
+    return composite_frame(prepare_photo(photo, size), frame_path, compositing)
+
+
+def render_avatars(source: PhotoSource, templates: List[FrameTemplate], size=None,
+                   compositing=DEFAULT_COMPOSITING) -> List[EncodedImage]:
+    # runs inside the render engine worker: decode and crop once, then composite and encode every template
+    with open_photo(source) as photo:
+        if size:
+            # JPEG: let the decoder scale down by 1/2..1/8 (DCT scaling) while keeping the image >= size
+            photo.draft('RGB', (size, size))
+        base = prepare_photo(photo, size)
+        if base is photo:
+            base = photo.copy()  # square photo: detach it from the file before it is closed
+
+    results = []
+    for i, template in enumerate(templates):
+        canvas = base if i == len(templates) - 1 else base.copy()
+        results.append(template.output.encode(composite_frame(canvas, template.frame, compositing)))
+    return results
+
+
+def render_avatar(source: PhotoSource, template: FrameTemplate, size=None,
+                  compositing=DEFAULT_COMPOSITING) -> EncodedImage:
+    return render_avatars(source, [template], size, compositing)[0]
+
+
+PREVIEW_SIZE = 160  # one of STANDARD_PHOTO_SIZES, so its overlay is warmed up
+PREVIEW_OUTPUT = OutputFormat('jpeg', quality=70)
+
+
+@async_wrap
+def render_preview(source: PhotoSource, template: FrameTemplate, size=PREVIEW_SIZE,
+                   compositing=DEFAULT_COMPOSITING) -> EncodedImage:
+    """
+    Quick low-res JPEG draft of the avatar. Runs in a thread of the bot process, not in the render engine,
+    so it is not held up by the render queue
+    """
+    return render_avatar(source, replace(template, output=PREVIEW_OUTPUT), size, compositing)
+
+
+GIF_MIME_TYPE = 'image/gif'
+
+
+@dataclass(frozen=True)
+class AnimationLimits:
+    size: int = 320  # output side
+    max_frames: int = 200  # the rest of the clip is cut
+    max_pixels: int = 200_000_000  # total pixels of decoded source frames, the rest of the clip is cut
+
+    @classmethod
+    def from_config(cls, cfg) -> 'AnimationLimits':
+        cfg = cfg.get('avatar', {}).get('animation', {})
+        return cls(size=int(cfg.get('size', cls.size)),
+                   max_frames=int(cfg.get('max_frames', cls.max_frames)),
+                   max_pixels=int(cfg.get('max_pixels', cls.max_pixels)))
+
+
+def render_animated_avatar(source: PhotoSource, template: FrameTemplate, limits: AnimationLimits,
+                           compositing=DEFAULT_COMPOSITING) -> EncodedImage:
+    """
+    Puts the frame over every frame of a GIF. Frames are decoded, composited and written one by one,
+    so only the current frame is held in memory. The output is always a GIF (template.output is ignored).
+    :raises PhotoSizeOutOfRange: if not even the first frame fits into the limits
+    """
+    t0 = time.perf_counter()
+    out = BytesIO()
+    header_written = False
+    pixels = 0
+
+    with open_photo(source) as animation:
+        for index, frame in enumerate(ImageSequence.Iterator(animation)):
+            pixels += frame.size[0] * frame.size[1]
+            if index >= limits.max_frames or pixels > limits.max_pixels:
+                if not header_written:
+                    raise PhotoSizeOutOfRange(f'the first frame {frame.size[0]}x{frame.size[1]} is out of {limits}')
+                break
+
+            duration = frame.info.get('duration', 100)
+            pic = composite_frame(prepare_photo(frame.convert('RGB'), limits.size), template.frame, compositing)
+            pic = pic.convert('RGB').quantize(256)
+
+            if not header_written:
+                header, _ = GifImagePlugin.getheader(pic, info={'loop': animation.info.get('loop', 0)})
+                out.writelines(header)
+                header_written = True
+            out.writelines(GifImagePlugin.getdata(pic, duration=duration, include_color_table=True))
+
+    out.write(b';')  # GIF trailer
+    return EncodedImage(out.getvalue(), time.perf_counter() - t0)
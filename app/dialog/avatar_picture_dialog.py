@@ -1,19 +1,28 @@
 import asyncio
-from contextlib import AsyncExitStack
+import logging
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import AsyncExitStack, suppress
+from io import BytesIO
+from typing import List, Optional
 
 from aiogram.dispatcher.filters.state import StatesGroup, State
-from aiogram.dispatcher.storage import FSMContextProxy
-from aiogram.types import Message, PhotoSize, ReplyKeyboardRemove, ContentTypes
+from aiogram.types import Message, PhotoSize, ReplyKeyboardRemove, ContentTypes, MediaGroup, InputMediaDocument
+from aiogram.utils.exceptions import TelegramAPIError
 from aiogram.utils.helper import HelperMode
 
-from dialog.avatar_image_work import download_tg_photo, get_userpic, combine_frame_and_photo_v2, img_to_bio
+from dialog.avatar_cache import AvatarResultCache
+from dialog.avatar_image_work import downloaded_photo, get_userpic_sizes, render_avatars, choose_photo_size, \
+    DEFAULT_TARGET_SIZE, default_template, frame_template_version, FrameTemplate, EncodedImage, \
+    DEFAULT_COMPOSITING, parse_templates, GIF_MIME_TYPE, render_animated_avatar, AnimationLimits, AdmissionLimits, \
+    AdmissionError, InvalidPhoto, PhotoFileTooBig, PhotoSizeOutOfRange, smallest_photo_size, render_preview, \
+    PREVIEW_SIZE
 from dialog.base import BaseDialog, message_handler
 from localization import BaseLocalization
-from lib.depcont import DepContainer
+from lib.render_engine import RenderQueueFull
+from lib.user_limiter import AlreadyInProgress, UserConcurrencyLimiter, TooBusy
 from lib.texts import kbd
 
-
-# todo: accept documents!
+logger = logging.getLogger('AvatarDialog')
 
 
 class AvatarStates(StatesGroup):
@@ -22,14 +31,35 @@ class AvatarStates(StatesGroup):
 
 
 class AvatarDialog(BaseDialog):
-    def __init__(self, loc: BaseLocalization, data: FSMContextProxy, d: DepContainer):
-        super().__init__(loc, data, d)
-        self._work_lock = asyncio.Lock()
+    KEY_LAST_PHOTO = 'last_photo'
+    MAX_MEDIA_GROUP = 10  # Telegram limit
+
+    @property
+    def target_size(self):
+        return int(self.deps.cfg.get('avatar', {}).get('target_size', DEFAULT_TARGET_SIZE))
+
+    @property
+    def compositing(self):
+        return self.deps.cfg.get('avatar', {}).get('render', {}).get('compositing', DEFAULT_COMPOSITING)
+
+    @property
+    def preview_size(self):
+        preview_cfg = self.deps.cfg.get('avatar', {}).get('preview', {})
+        return int(preview_cfg.get('size', PREVIEW_SIZE)) if preview_cfg.get('enabled', True) else 0
+
+    @property
+    def admission_limits(self):
+        return AdmissionLimits.from_config(self.deps.cfg)
+
+    @property
+    def templates(self) -> List[FrameTemplate]:
+        return list(parse_templates(self.deps.cfg).values())[:self.MAX_MEDIA_GROUP]
 
     def menu_kbd(self):
-        return kbd([
-            self.loc.BUTTON_AVA_FROM_MY_USERPIC,
-        ], vert=True)
+        buttons = [self.loc.BUTTON_AVA_FROM_MY_USERPIC]
+        if len(self.templates) > 1:
+            buttons.append(self.loc.BUTTON_AVA_ALL_FRAMES)
+        return kbd(buttons, vert=True)
 
     @message_handler(state=None)
     async def on_no_state(self, message: Message):
@@ -39,43 +69,211 @@ class AvatarDialog(BaseDialog):
     async def on_enter(self, message: Message):
         if message.text == self.loc.BUTTON_AVA_FROM_MY_USERPIC:
             await self.handle_avatar_picture(message, self.loc)
+        elif message.text == self.loc.BUTTON_AVA_ALL_FRAMES:
+            last_photo = self.data.get(self.KEY_LAST_PHOTO)
+            last_photo = PhotoSize(**last_photo) if last_photo else None
+            await self.handle_avatar_picture(message, self.loc, explicit_picture=last_photo, templates=self.templates)
         else:
             await AvatarStates.MAIN.set()
             await message.answer(self.loc.TEXT_AVA_WELCOME, reply_markup=self.menu_kbd())
 
     @message_handler(state=AvatarStates.MAIN, content_types=ContentTypes.PHOTO)
     async def on_picture(self, message: Message):
-        await self.handle_avatar_picture(message, self.loc, explicit_picture=message.photo[0])
+        photo = choose_photo_size(message.photo, self.target_size)
+        self.data[self.KEY_LAST_PHOTO] = photo.to_python()  # for "all frames" button
+        await self.handle_avatar_picture(message, self.loc, explicit_picture=photo,
+                                         preview_picture=smallest_photo_size(message.photo))
+
+    @message_handler(state=AvatarStates.MAIN, content_types=ContentTypes.DOCUMENT | ContentTypes.ANIMATION)
+    async def on_document(self, message: Message):
+        # animations come with the document field as well
+        document = message.animation or message.document
+        mime_type = str(document.mime_type or '')
+        if mime_type == GIF_MIME_TYPE:
+            await self.handle_avatar_picture(message, self.loc, explicit_picture=document, animated=True)
+        elif mime_type.startswith('image/'):
+            await self.handle_avatar_picture(message, self.loc, explicit_picture=document,
+                                             preview_picture=document.thumb)
+        elif message.animation:
+            await message.answer(self.loc.TEXT_AVA_ERR_ANIMATION_FORMAT, reply_markup=self.menu_kbd())
+        else:
+            await message.answer(self.loc.TEXT_AVA_ERR_INVALID, reply_markup=self.menu_kbd())
+
+    async def handle_avatar_picture(self, message: Message, loc: BaseLocalization, explicit_picture: PhotoSize = None,
+                                    templates: List[FrameTemplate] = None, animated=False,
+                                    preview_picture: PhotoSize = None):
+        if explicit_picture is not None:
+            photo = explicit_picture
+        else:
+            sizes = await get_userpic_sizes(message.from_user)
+            photo = choose_photo_size(sizes, self.target_size)
+            preview_picture = smallest_photo_size(sizes)
+
+        if photo is None:
+            await message.answer(loc.TEXT_AVA_ERR_NO_PIC, reply_markup=self.menu_kbd())
+            return
+
+        try:
+            self.admission_limits.check_file_size(photo.file_size)  # don't even start downloading
+        except PhotoFileTooBig:
+            await message.answer(loc.TEXT_AVA_ERR_FILE_SIZE, reply_markup=self.menu_kbd())
+            return
+
+        templates = templates or [default_template(self.deps.cfg)]
+        if animated:
+            limits = AnimationLimits.from_config(self.deps.cfg)
+            versions = [f'{frame_template_version(t, limits.size)}-gif{limits.max_frames}' for t in templates]
+        else:
+            versions = [frame_template_version(t, self.target_size) for t in templates]
+
+        result_cache: AvatarResultCache = self.deps.avatar_cache
+        cached = [await result_cache.get(photo.file_unique_id, version) for version in versions]
+        if all(c.file_id for c in cached):
+            try:
+                await self._send_avatars(message, loc, [c.file_id for c in cached])
+                return
+            except TelegramAPIError:
+                for c in cached:
+                    c.file_id = ''  # e.g. the bot token has changed, upload them again
+
+        user_id = message.from_user.id
+        limiter: UserConcurrencyLimiter = self.deps.user_limiter
 
-    async def handle_avatar_picture(self, message: Message, loc: BaseLocalization, explicit_picture: PhotoSize = None):
         async with AsyncExitStack() as stack:
-            stack.enter_async_context(self._work_lock)
+            try:
+                await stack.enter_async_context(limiter.acquire(user_id))
+            except AlreadyInProgress:
+                await message.answer(loc.TEXT_AVA_ERR_IN_PROGRESS, disable_notification=True)
+                return
+            except TooBusy:
+                await message.answer(loc.TEXT_AVA_ERR_BUSY, reply_markup=self.menu_kbd())
+                return
 
             # POST A LOADING STICKER
             sticker = await message.answer_sticker(self.loc.LOADING_STICKER,
                                                    disable_notification=True,
                                                    reply_markup=ReplyKeyboardRemove())
             # CLEAN UP IN THE END
-            stack.push_async_callback(sticker.delete)
+            stack.push_async_callback(self._delete_quietly, sticker)
 
-            if explicit_picture is not None:
-                user_pic = await download_tg_photo(explicit_picture)
-            else:
-                user_pic = await get_userpic(message.from_user)
+            pics_data = await asyncio.gather(*(result_cache.load_bytes(c) for c in cached))
+            if any(data is None for data in pics_data):
+                if not animated and self.preview_size and preview_picture is not None \
+                        and preview_picture.file_unique_id != photo.file_unique_id:
+                    # the preview replaces the sticker, the full-size avatar replaces the preview
+                    preview = asyncio.ensure_future(self._show_preview(message, loc, preview_picture,
+                                                                       templates[0], sticker))
+                    stack.push_async_callback(self._drop_preview, preview)
 
-            w, h = user_pic.size
-            if not w or not h:
-                await message.answer(loc.TEXT_AVA_ERR_INVALID, reply_markup=self.menu_kbd())
-                return
+                results = await self._render(message, loc, photo, templates, animated)
+                if results is None:
+                    return
+                pics_data = [r.data for r in results]
+                digests = await asyncio.gather(*(result_cache.store_bytes(data) for data in pics_data))
+                for c, digest in zip(cached, digests):
+                    c.digest = digest
 
-            if not ((64 <= w <= 4096) and (64 <= h <= 4096)):
-                await message.answer(loc.TEXT_AVA_ERR_SIZE, reply_markup=self.menu_kbd())
+            pics = []
+            for template, data in zip(templates, pics_data):
+                pic = BytesIO(data)
+                extension = 'gif' if animated else template.output.extension
+                pic.name = f'alpha_avatar_{user_id}_{template.name}.{extension}'
+                pics.append(pic)
+
+            file_ids = await self._send_avatars(message, loc, pics)
+            for c, version, file_id in zip(cached, versions, file_ids):
+                c.file_id = file_id
+                await result_cache.put(photo.file_unique_id, version, c)
+
+    async def _send_avatars(self, message: Message, loc: BaseLocalization, documents: list) -> List[str]:
+        """
+        One avatar is sent as a document, several ones as a media group; returns their Telegram file_ids
+        """
+        if len(documents) == 1:
+            sent = await message.answer_document(documents[0], caption=loc.TEXT_AVA_READY,
+                                                 reply_markup=self.menu_kbd())
+            return [sent.document.file_id]
+
+        media = MediaGroup()
+        for document in documents:
+            media.attach(InputMediaDocument(document))
+        sent_messages = await message.answer_media_group(media)
+        await message.answer(loc.TEXT_AVA_READY, reply_markup=self.menu_kbd())  # media groups have no keyboard
+        return [m.document.file_id for m in sent_messages]
+
+    @staticmethod
+    async def _delete_quietly(message: Message):
+        with suppress(TelegramAPIError):  # already deleted
+            await message.delete()
+
+    async def _show_preview(self, message: Message, loc: BaseLocalization, photo: PhotoSize,
+                            template: FrameTemplate, placeholder: Message) -> Optional[Message]:
+        try:
+            async with downloaded_photo(photo, limits=self.admission_limits) as source:
+                result = await render_preview(source, template, self.preview_size, self.compositing)
+            pic = BytesIO(result.data)
+            pic.name = 'alpha_avatar_preview.jpg'
+            preview = await message.answer_photo(pic, caption=loc.TEXT_AVA_PREVIEW, disable_notification=True)
+        except Exception as e:
+            # the preview is optional, the full-size avatar still comes
+            logger.warning(f'no preview: {e!r}')
+            return None
+        await self._delete_quietly(placeholder)
+        return preview
+
+    async def _drop_preview(self, task: asyncio.Future):
+        if not task.done():
+            task.cancel()  # the full-size avatar has outrun it
+        with suppress(asyncio.CancelledError):
+            preview = await task
+            if preview is not None:
+                await self._delete_quietly(preview)
+
+    async def _render(self, message: Message, loc: BaseLocalization, photo: PhotoSize,
+                      templates: List[FrameTemplate], animated=False) -> List[EncodedImage]:
+        async with AsyncExitStack() as stack:
+            try:
+                source = await stack.enter_async_context(downloaded_photo(photo, limits=self.admission_limits))
+            except AdmissionError as e:
+                logger.warning(f'photo rejected: {e!r}')
+                if isinstance(e, InvalidPhoto):
+                    text = loc.TEXT_AVA_ERR_INVALID
+                elif isinstance(e, PhotoFileTooBig):
+                    text = loc.TEXT_AVA_ERR_FILE_SIZE
+                else:
+                    text = loc.TEXT_AVA_ERR_SIZE
+                await message.answer(text, reply_markup=self.menu_kbd())
                 return
 
-            # pic = await combine_frame_and_photo(self.deps.cfg, user_pic)
-            pic = await combine_frame_and_photo_v2(self.deps.cfg, user_pic)
+            async def notify_in_line(position):
+                await message.answer(loc.text_ava_in_line(position), disable_notification=True)
 
-            user_id = message.from_user.id
-            pic = img_to_bio(pic, name=f'alpha_avatar_{user_id}.png')
+            engine = self.deps.render_engine
+            try:
+                if animated:
+                    results = [
+                        await engine.submit(render_animated_avatar, source, template,
+                                            AnimationLimits.from_config(self.deps.cfg), self.compositing,
+                                            on_wait=notify_in_line)
+                        for template in templates
+                    ]
+                else:
+                    results = await engine.submit(render_avatars, source, templates,
+                                                  self.target_size, self.compositing,
+                                                  on_wait=notify_in_line)
+            except PhotoSizeOutOfRange as e:  # the animation limits are checked while rendering
+                logger.warning(f'photo rejected: {e!r}')
+                await message.answer(loc.TEXT_AVA_ERR_SIZE, reply_markup=self.menu_kbd())
+                return
+            except RenderQueueFull:
+                await message.answer(loc.TEXT_AVA_ERR_BUSY, reply_markup=self.menu_kbd())
+                return
+            except BrokenProcessPool:
+                logger.error(f'render worker died twice on the photo {photo.file_unique_id}')
+                await message.answer(loc.TEXT_AVA_ERR_RENDER, reply_markup=self.menu_kbd())
+                return
 
-            await message.answer_document(pic, caption=loc.TEXT_AVA_READY, reply_markup=self.menu_kbd())
+        for template, result in zip(templates, results):
+            logger.info(f'avatar {template.name!r} encoded as {template.output.format}: '
+                        f'{len(result.data)} bytes in {result.encode_time:.3f} sec')
+        return results
@@ -3,6 +3,7 @@ from aiogram.types import *
 
 from dialog.avatar_picture_dialog import AvatarDialog
 from dialog.base import BaseDialog, message_handler
+from jobs.charts import ChartKeeper
 
 
 class MainMenuDialog(BaseDialog):
@@ -16,6 +17,25 @@ class MainMenuDialog(BaseDialog):
                              disable_web_page_preview=True,
                              disable_notification=True)
 
+    @message_handler(commands='chart', state='*')
+    async def cmd_chart(self, message: Message):
+        metric, window = ChartKeeper.METRIC_PRICE, ChartKeeper.DEFAULT_WINDOW
+        for arg in message.get_args().lower().split():
+            if arg in ChartKeeper.METRICS:
+                metric = arg
+            elif arg in ChartKeeper.WINDOWS:
+                window = arg
+            else:
+                await message.answer(self.loc.text_chart_usage(ChartKeeper.METRICS, ChartKeeper.WINDOWS),
+                                     disable_notification=True)
+                return
+
+        chart = await self.deps.charts.get_chart(metric, window)
+        if chart is None:
+            await message.answer(self.loc.TEXT_CHART_NO_DATA, disable_notification=True)
+            return
+        await ChartKeeper.send(chart, lambda photo: message.answer_photo(photo, disable_notification=True))
+
     @message_handler(filters.RegexpCommandsFilter(regexp_commands=[r'/.*']), state='*')
     async def on_unknown_command(self, message: Message):
         await message.answer(self.loc.unknown_command(), disable_notification=True)
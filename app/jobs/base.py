@@ -33,23 +33,34 @@ class BaseFetcher(ABC):
         for delegate in self.delegates:
             await delegate.on_error(self, e)
 
+    async def run_once(self) -> bool:
+        """
+        One fetch and its delegates, errors are logged and passed to the delegates
+        :return: True if it went without errors
+        """
+        try:
+            data = await self.fetch()
+            if data:
+                for delegate in self.delegates:
+                    delegate: INotified
+                    await delegate.on_data(self, data)
+            return True
+
+        except Exception as e:
+            self.logger.exception(f"task error: {e}")
+
+            try:
+                await self.handle_error(e)
+            except Exception as e:
+                self.logger.exception(f"task error while handling on_error: {e}")
+            return False
+
     async def run(self):
+        """
+        Simple loop: sleep_period is counted from the end of the previous run, see jobs.scheduler for a fixed rate
+        """
         self.logger.info(f'Starting job after sleep {self.startup_sleep} sec every {self.sleep_period} sec')
         await asyncio.sleep(self.startup_sleep)
         while True:
-            try:
-                data = await self.fetch()
-                if data:
-                    for delegate in self.delegates:
-                        delegate: INotified
-                        await delegate.on_data(self, data)
-
-            except Exception as e:
-                self.logger.exception(f"task error: {e}")
-
-                try:
-                    await self.handle_error(e)
-                except Exception as e:
-                    self.logger.exception(f"task error while handling on_error: {e}")
-
+            await self.run_once()
             await asyncio.sleep(self.sleep_period)
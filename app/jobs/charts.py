@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Optional, Awaitable, Callable
+
+from aiogram.types import InputFile, Message
+
+from jobs.defipulse_job import DefiPulseKeeper
+from jobs.price_job import PriceFetcher
+from lib.charts import render_sparkline, bucketize
+from lib.datetime import DAY, HOUR, MINUTE
+from lib.depcont import DepContainer
+from lib.timeseries import TimeSeries
+from lib.utils import async_wrap
+
+
+@dataclass
+class ChartImage:
+    key: tuple  # (metric, window, bucket, timestamp of the last point)
+    data: bytes
+    file_id: str = ''  # set after the first upload, then the picture is never uploaded again
+    upload_lock: asyncio.Lock = field(default_factory=asyncio.Lock, compare=False, repr=False)
+
+    @property
+    def filename(self):
+        metric, window, *_ = self.key
+        return f'alpha_{metric}_{window}.png'
+
+    def as_photo(self):
+        return self.file_id or InputFile(BytesIO(self.data), filename=self.filename)
+
+
+class ChartKeeper:
+    """
+    Charts of the recorded price and TVL. A chart is rendered once per (metric, window, bucket) and
+    is reused until a new data point arrives. After the first upload it is sent by its Telegram file_id.
+    """
+
+    METRIC_PRICE = 'price'
+    METRIC_TVL = 'tvl'
+    METRIC_RANK = 'rank'
+    METRICS = (METRIC_PRICE, METRIC_TVL, METRIC_RANK)
+    INVERTED_METRICS = (METRIC_RANK,)  # #1 is the best: drawn upside down
+
+    WINDOWS = {  # name -> (length, bucket)
+        '24h': (DAY, 5 * MINUTE),
+        '7d': (7 * DAY, HOUR),
+        '30d': (30 * DAY, 6 * HOUR),
+    }
+    DEFAULT_WINDOW = '7d'
+
+    def __init__(self, deps: DepContainer):
+        self.deps = deps
+        self.logger = logging.getLogger(self.__class__.__name__)
+        coin = PriceFetcher.coins_from_config(deps.cfg)[0]
+        tvl_history = DefiPulseKeeper.make_history(deps)
+        self.series = {  # metric -> (series, value field)
+            self.METRIC_PRICE: (TimeSeries(deps.db, PriceFetcher.series_name(coin)), 'usd'),
+            self.METRIC_TVL: (tvl_history, 'usd'),
+            self.METRIC_RANK: (tvl_history, 'rank'),
+        }
+        self.titles = {
+            self.METRIC_PRICE: (f'{coin.upper()} price, USD', '${:,.3f}'),
+            self.METRIC_TVL: ('Alpha Homora TVL, USD', '${:,.0f}'),
+            self.METRIC_RANK: ('Alpha Homora DeFi Pulse rank', '#{:.0f}'),
+        }
+        self._charts = {}  # (metric, window) -> ChartImage
+        self._locks = defaultdict(asyncio.Lock)
+        self.renders = 0
+
+    async def get_chart(self, metric=METRIC_PRICE, window=DEFAULT_WINDOW) -> Optional[ChartImage]:
+        """
+        :return: the chart or None if there is no data at all
+        :raises KeyError: unknown metric or window
+        """
+        series, value_field = self.series[metric]
+        length, bucket = self.WINDOWS[window]
+
+        async with self._locks[(metric, window)]:  # everyone else waits for the one render
+            last = await series.last()
+            if last is None:
+                return None
+
+            key = (metric, window, bucket, last.timestamp)
+            chart = self._charts.get((metric, window))
+            if chart is not None and chart.key == key:
+                return chart
+
+            points = await series.range(last.timestamp - length, last.timestamp)
+            # e.g. the price history keeps 8 days: its 30d chart is titled with what is really there
+            span = last.timestamp - points[0].timestamp
+            label = window if span >= length - bucket else self._span_label(span)
+            points = bucketize([(p.timestamp, float(p.values.get(value_field, 0.0))) for p in points], bucket)
+            title, value_format = self.titles[metric]
+            data = await async_wrap(render_sparkline)(points, f'{title}, {label}', value_format,
+                                                      invert=metric in self.INVERTED_METRICS)
+            self.renders += 1
+
+            chart = self._charts[(metric, window)] = ChartImage(key, data)
+            self.logger.info(f'rendered {metric} chart for {window}: {len(points)} points, {len(data)} bytes')
+            return chart
+
+    @staticmethod
+    def _span_label(seconds):
+        if seconds >= DAY:
+            return f'{round(seconds / DAY)}d'
+        return f'{max(1, round(seconds / HOUR))}h'
+
+    @staticmethod
+    async def send(chart: ChartImage, send_photo: Callable[..., Awaitable[Message]]) -> Message:
+        """
+        Sends the chart with send_photo(photo) uploading it only once, concurrent senders wait for the upload
+        """
+        if not chart.file_id:
+            async with chart.upload_lock:
+                if not chart.file_id:
+                    sent = await send_photo(chart.as_photo())
+                    chart.file_id = sent.photo[-1].file_id
+                    return sent
+        return await send_photo(chart.file_id)
@@ -1,12 +1,17 @@
+import json
 import logging
-from typing import List
+from typing import List, AsyncIterable, AsyncIterator, Set, Optional
 
 import aioredis
 import typing
 
 from jobs.base import BaseFetcher, INotified
-from lib.datetime import parse_timespan_to_seconds
+from lib.atomic_max import AtomicMax
+from lib.datetime import parse_timespan_to_seconds, DAY
 from lib.depcont import DepContainer
+from lib.json_stream import aiter_array_items
+from lib.leaderboard import LeaderboardSnapshot, diff_snapshots
+from lib.timeseries import TieredTimeSeries
 
 from models.models import DefiPulseEntry
 
@@ -19,16 +24,41 @@ class DefiPulseFetcher(BaseFetcher):
         cfg = deps.cfg.data_source.defi_pulse
         super().__init__(deps, parse_timespan_to_seconds(cfg.fetch_period))
         self._defipulse_api_key = cfg.api_token
+        self.tracked_projects = set(cfg.get('projects') or [self.ALPHA_NAME])
+        # the leaderboard needs every project, otherwise the download stops at the tracked ones
+        self.whole_leaderboard = bool(cfg.get('leaderboard', True))
 
     async def fetch(self):
         return await self._fetch_defipulse()
 
     async def _fetch_defipulse(self):
         url = self.URL_DEFI_PULSE_PROJECTS.format(api_key=self._defipulse_api_key)
-        async with self.deps.session.get(url) as reps:
-            response_j = await reps.json()
-            self.logger.info(f'got fresh defipulse data ({len(response_j)} items)')
-            return self.parse_defipulse(response_j)
+        names = None if self.whole_leaderboard else self.tracked_projects
+        async with self.deps.http.stream(url) as chunks:
+            entries = [e async for e in self.parse_defipulse_stream(chunks, names)]
+        self.logger.info(f'got fresh defipulse data ({len(entries)} projects)')
+        return entries
+
+    @staticmethod
+    async def parse_defipulse_stream(chunks: AsyncIterable[bytes],
+                                     names: Optional[Set[str]] = None) -> AsyncIterator[DefiPulseEntry]:
+        """
+        Yields the entries of the projects with the given names (ranked by their position in the list)
+        and stops reading as soon as all of them are found. Other projects are not even decoded.
+        names = None: every project.
+        """
+        left = set(names) if names is not None else None
+        wanted = left.__contains__ if left is not None else (lambda name: True)
+        async for rank, name, raw in aiter_array_items(chunks, key='name', wanted=wanted):
+            if raw is None:
+                continue
+            entry = DefiPulseEntry.parse(json.loads(raw))
+            entry.rank = rank
+            yield entry
+            if left is not None:
+                left.discard(name)
+                if not left:
+                    break
 
     @staticmethod
     def parse_defipulse(response):
@@ -38,10 +68,22 @@ class DefiPulseFetcher(BaseFetcher):
 class DefiPulseKeeper(INotified):
     KEY_DEFIPULSE = 'defipulse:alpha:last'
     KEY_TLV_ATH_USD = 'defipulse:alpha:tlv_ath_usd'
+    KEY_LEADERBOARD = 'defipulse:leaderboard:last'
+    TVL_SERIES = 'tvl:alpha'
 
     def __init__(self, deps: DepContainer):
         self.deps = deps
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.tlv_ath = AtomicMax(deps.db, self.KEY_TLV_ATH_USD)
+        self.tvl_history = self.make_history(deps)
+
+    @classmethod
+    def make_history(cls, deps: DepContainer) -> TieredTimeSeries:
+        """
+        TVL, its relative daily change and the rank after every fetch
+        """
+        cfg = deps.cfg.get('data_source', {}).get('defi_pulse', {}).get('history', {})
+        return TieredTimeSeries.from_config(deps.db, cls.TVL_SERIES, cfg)
 
     async def on_data(self, sender, data: List[DefiPulseEntry]):
         alpha: DefiPulseEntry = self.find_alpha(data)
@@ -59,16 +101,49 @@ class DefiPulseKeeper(INotified):
         else:
             alpha.rank_delta = 0
 
-        r: aioredis.Redis = await self.deps.db.get_redis()
+        alpha.tlv_usd_relative_7d = await self.tvl_change_ago(alpha.tlv_usd, alpha.timestamp, DAY * 7)
+
+        if len(data) > 1:
+            await self.update_leaderboard(alpha, data)
+
+        prev_tlv_ath, alpha.tlv_is_ath = await self.tlv_ath.update(alpha.tlv_usd)
+        if alpha.tlv_is_ath:
+            self.logger.info(f'updated TLV ATH ${float(prev_tlv_ath or 0.0)} -> ${alpha.tlv_usd}')
 
-        prev_tlv_ath = float((await r.get(self.KEY_TLV_ATH_USD)) or 0.0)
-        if alpha.tlv_usd > prev_tlv_ath:
-            await r.set(self.KEY_TLV_ATH_USD, alpha.tlv_usd)
-            self.logger.info(f'updated TLV ATH ${prev_tlv_ath} -> ${alpha.tlv_usd}')
-            alpha.tlv_is_ath = True
+        await self.tvl_history.add({
+            'usd': alpha.tlv_usd,
+            'change': alpha.tlv_usd_relative_1d,
+            'rank': alpha.rank,
+        }, alpha.timestamp)
 
+        r: aioredis.Redis = await self.deps.db.get_redis()
         await r.set(self.KEY_DEFIPULSE, alpha.to_json())
 
+    async def update_leaderboard(self, alpha: DefiPulseEntry, data: List[DefiPulseEntry]):
+        """
+        Saves the snapshot of the whole leaderboard and fills in who overtook Alpha since the previous one
+        """
+        snapshot = LeaderboardSnapshot.from_entries(data, alpha.timestamp)
+        r: aioredis.Redis = await self.deps.db.get_redis()
+        prev_data = await r.get(self.KEY_LEADERBOARD)
+        await r.set(self.KEY_LEADERBOARD, snapshot.to_bytes())
+        if not prev_data:
+            return
+
+        diff = diff_snapshots(LeaderboardSnapshot.from_bytes(prev_data), snapshot)
+        alpha.overtook_us = diff.overtook(alpha.id)
+        alpha.we_overtook = diff.overtaken_by(alpha.id)
+        if alpha.overtook_us or alpha.we_overtook:
+            self.logger.info(f'leaderboard: overtook us {alpha.overtook_us}, we overtook {alpha.we_overtook}')
+
+    async def tvl_change_ago(self, tvl_usd, now, ago, tolerance=DAY) -> typing.Optional[float]:
+        """
+        :return: TVL change in % since "ago" seconds before now or None if there is no history point that old
+        """
+        point = await self.tvl_history.nearest(now - ago, tolerance)
+        old_tvl = float(point.values.get('usd', 0.0)) if point else 0.0
+        return (tvl_usd - old_tvl) / old_tvl * 100.0 if old_tvl else None
+
     async def get_last_state(self) -> typing.Optional[DefiPulseEntry]:
         r: aioredis.Redis = await self.deps.db.get_redis()
         data = await r.get(self.KEY_DEFIPULSE)
@@ -76,9 +151,10 @@ class DefiPulseKeeper(INotified):
 
     @staticmethod
     def find_alpha(items: List[DefiPulseEntry]):
+        # entries from the stream parser know their rank already, a full list is ranked by the position
         ranked_items = ((rank, item) for rank, item in enumerate(items, start=1))
         result = next(((rank, item) for rank, item in ranked_items if item.name == DefiPulseFetcher.ALPHA_NAME), None)
         if result:
             rank, item = result
-            item.rank = rank
+            item.rank = item.rank or rank
             return item
@@ -0,0 +1,21 @@
+from typing import List
+
+from jobs.base import BaseFetcher
+from lib.datetime import HOUR
+from lib.depcont import DepContainer
+from lib.timeseries import TieredTimeSeries
+
+
+class HistoryCompactor(BaseFetcher):
+    """
+    Downsamples and trims the tiered histories in the background, it has no data for the delegates
+    """
+
+    def __init__(self, deps: DepContainer, histories: List[TieredTimeSeries], period=HOUR):
+        super().__init__(deps, period)
+        self.histories = histories
+
+    async def fetch(self):
+        for history in self.histories:
+            written = await history.compact()
+            self.logger.info(f'compacted {history.name}: {written} points in the coarser tiers')
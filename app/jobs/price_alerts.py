@@ -0,0 +1,139 @@
+import logging
+from collections import deque, namedtuple
+from dataclasses import dataclass
+from typing import List
+
+from lib.cooldown import Cooldown
+from lib.datetime import parse_timespan_to_seconds, MINUTE
+from lib.depcont import DepContainer
+from lib.texts import calc_percent_change
+
+PricePoint = namedtuple('PricePoint', ('timestamp', 'price'))
+
+
+class RollingWindow:
+    """
+    Prices of the last "window" seconds in a ring buffer of fixed capacity.
+    Min and max are kept in monotonic queues, so every update is O(1) amortized.
+    """
+
+    def __init__(self, window, capacity):
+        self.window = window
+        self.points = deque(maxlen=max(2, int(capacity)))
+        self._min = deque()  # increasing prices
+        self._max = deque()  # decreasing prices
+
+    def add(self, timestamp, price):
+        point = PricePoint(timestamp, price)
+        self.points.append(point)
+
+        while self._min and self._min[-1].price >= price:
+            self._min.pop()
+        self._min.append(point)
+        while self._max and self._max[-1].price <= price:
+            self._max.pop()
+        self._max.append(point)
+
+        # drop what has left the window by time or has been pushed out of the ring buffer
+        oldest = max(timestamp - self.window, self.points[0].timestamp)
+        while self.points[0].timestamp < oldest:
+            self.points.popleft()
+        for q in (self._min, self._max):
+            while q[0].timestamp < oldest:
+                q.popleft()
+
+    @property
+    def low(self) -> PricePoint:
+        return self._min[0]
+
+    @property
+    def high(self) -> PricePoint:
+        return self._max[0]
+
+    def __len__(self):
+        return len(self.points)
+
+
+@dataclass(frozen=True)
+class PriceAlertRule:
+    window: float  # sec
+    threshold: float  # percent, both directions
+    cooldown: float  # sec
+
+    @property
+    def name(self):
+        return f'{int(self.window)}s:{self.threshold:g}%'
+
+    @classmethod
+    def from_config(cls, cfg) -> 'PriceAlertRule':
+        return cls(window=parse_timespan_to_seconds(str(cfg.get('window', '15m'))),
+                   threshold=float(cfg.get('threshold', 5.0)),
+                   cooldown=parse_timespan_to_seconds(str(cfg.get('cooldown', '1h'))))
+
+
+@dataclass
+class PriceAlert:
+    rule: PriceAlertRule
+    price: float
+    reference: PricePoint  # the low for a rise, the high for a drop
+    change: float  # percent
+
+    @property
+    def is_up(self):
+        return self.change > 0
+
+
+class PriceAlertEngine:
+    """
+    Checks every fetched price against the rules (e.g. "moved more than 5% in 15 minutes").
+    A move is measured from the lowest (up) or the highest (down) price in the rule's window.
+    """
+
+    def __init__(self, deps: DepContainer, rules: List[PriceAlertRule], sample_period=MINUTE):
+        self.deps = deps
+        self.rules = rules
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.windows = {
+            rule: RollingWindow(rule.window, capacity=rule.window / max(1, sample_period) + 2)
+            for rule in rules
+        }
+        self.cooldowns = {
+            rule: Cooldown(deps.db, f'price_alert:{rule.name}', rule.cooldown)
+            for rule in rules
+        }
+
+    @classmethod
+    def from_config(cls, deps: DepContainer) -> 'PriceAlertEngine':
+        rules = [PriceAlertRule.from_config(c) for c in deps.cfg.notifications.price.get('alerts', [])]
+        sample_period = parse_timespan_to_seconds(str(deps.cfg.data_source.coin_gecko.fetch_period))
+        return cls(deps, rules, sample_period)
+
+    def update(self, timestamp, price) -> List[PriceAlert]:
+        """
+        Adds the price to every window and returns the alerts that fire (cooldowns are not checked here)
+        """
+        alerts = []
+        if not price or price <= 0:
+            return alerts
+        for rule, window in self.windows.items():
+            window.add(timestamp, price)
+            rise = calc_percent_change(window.low.price, price)
+            drop = calc_percent_change(window.high.price, price)
+            if rise >= rule.threshold:
+                alerts.append(PriceAlert(rule, price, window.low, rise))
+            elif -drop >= rule.threshold:
+                alerts.append(PriceAlert(rule, price, window.high, drop))
+        return alerts
+
+    async def check(self, timestamp, price) -> List[PriceAlert]:
+        """
+        Alerts to send now: the ones that fire and whose rules are not cooling down
+        """
+        results = []
+        for alert in self.update(timestamp, price):
+            cd = self.cooldowns[alert.rule]
+            if await cd.can_do():
+                await cd.do()
+                self.logger.info(f'price alert {alert.rule.name}: {alert.change:+.2f} %')
+                results.append(alert)
+        return results
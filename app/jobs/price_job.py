@@ -1,14 +1,18 @@
 import asyncio
+import logging
 from collections import namedtuple
-from typing import List
+from typing import List, Dict, Tuple
 
 from jobs.base import BaseFetcher, INotified
 from jobs.defipulse_job import DefiPulseKeeper
+from jobs.price_alerts import PriceAlertEngine, PriceAlert
+from lib.atomic_max import AtomicMax
 from lib.cooldown import OnceADay, Cooldown
 from lib.datetime import parse_timespan_to_seconds, now_ts, HOUR, MINUTE, DAY, parse_time, \
     is_time_to_do
 from lib.depcont import DepContainer
-from lib.texts import MessageType
+from lib.texts import MessageType, BoardMessage
+from lib.timeseries import TimeSeries, TimeSeriesPoint, nearest_point
 from lib.utils import circular_shuffled_iterator
 from localization import LocalizationManager
 from models.models import CoinPriceInfo, PriceReport, PriceHistoricalTriplet, DefiPulseEntry, PriceATH
@@ -18,70 +22,183 @@ PriceAndDate = namedtuple('PriceAndDate', ('timestamp', 'price'))
 
 class PriceFetcher(BaseFetcher):
     ALPHA_GECKO_NAME = 'alpha-finance'
-    COIN_RANK_GECKO = "https://api.coingecko.com/api/v3/coins/{coin}?" \
-                      "localization=false&tickers=false&market_data=false&" \
-                      "community_data=false&developer_data=false&sparkline=false"
+    COIN_MARKETS_GECKO = "https://api.coingecko.com/api/v3/coins/markets?" \
+                         "vs_currency=usd&ids={coins}&per_page=250&sparkline=false"
 
     COIN_PRICE_GECKO = "https://api.coingecko.com/api/v3/simple/price?" \
-                       "ids={coin}&vs_currencies=usd%2Cbtc&include_market_cap=true&include_24hr_change=true"
+                       "ids={coins}&vs_currencies=usd%2Cbtc&include_market_cap=true&include_24hr_change=true"
 
     COIN_PRICE_HISTORY_GECKO = "https://api.coingecko.com/api/v3/coins/{coin}/market_chart/range?" \
                                "vs_currency=usd&from={t_from}&to={t_to}"
 
+    MAX_URL_LENGTH = 2000  # safe for any proxy on the way
+    MAX_IDS_PER_REQUEST = 250  # page size of coins/markets
+
+    DEFAULT_REFRESH_PERIODS = {
+        'rank': '1h',
+        'price_1h': '1m',
+        'price_24h': '5m',
+        'price_7d': '1h',
+    }
+
     def __init__(self, deps: DepContainer):
         cfg = deps.cfg.data_source.coin_gecko
         super().__init__(deps, parse_timespan_to_seconds(cfg.fetch_period))
 
-    async def fetch(self) -> PriceReport:
-        self.logger.info('start job')
+        self.coins = self.coins_from_config(deps.cfg)
+
+        history_cfg = cfg.get('history', {})
+        retention = parse_timespan_to_seconds(history_cfg.get('retention', '8d'))
+        resolution = parse_timespan_to_seconds(history_cfg.get('resolution', '5m'))
+        self.histories = {
+            coin: TimeSeries(deps.db, self.series_name(coin), retention=retention, resolution=resolution)
+            for coin in self.coins
+        }
+
+        # the spot price is fetched every cycle, the rest only when its period has passed
+        refresh_cfg = cfg.get('refresh', {})
+        self.refresh_periods = {
+            name: parse_timespan_to_seconds(str(refresh_cfg.get(name, default)))
+            for name, default in self.DEFAULT_REFRESH_PERIODS.items()
+        }
+        self._resources = {}  # key -> (timestamp, value)
+
+    @classmethod
+    def coins_from_config(cls, cfg) -> List[str]:
+        # the first one is the main coin of the notifications, the rest is the watchlist
+        return list(cfg.data_source.coin_gecko.get('coins') or [cls.ALPHA_GECKO_NAME])
+
+    @staticmethod
+    def series_name(coin):
+        return f'price:{coin}'
+
+    @property
+    def primary_coin(self):
+        return self.coins[0]
+
+    @classmethod
+    def chunk_coins(cls, url_template: str, coins: List[str]) -> List[List[str]]:
+        """
+        Splits the coin ids so that every URL made of url_template and a chunk fits MAX_URL_LENGTH
+        """
+        chunks, chunk = [], []
+        for coin in coins:
+            candidate = chunk + [coin]
+            too_long = len(url_template.format(coins='%2C'.join(candidate))) > cls.MAX_URL_LENGTH
+            if chunk and (too_long or len(candidate) > cls.MAX_IDS_PER_REQUEST):
+                chunks.append(chunk)
+                candidate = [coin]
+            chunk = candidate
+        if chunk:
+            chunks.append(chunk)
+        return chunks
 
+    async def _refreshed(self, name, fetch_coro_func, *args, key=None):
+        """
+        The last value of the resource if it is fresh enough, otherwise a new one.
+        If the update fails, the old value is used while there is one.
+        :param key: cache key if the resource "name" has several instances (e.g. one per coin)
+        """
+        key = key or name
         now = now_ts()
+        last = self._resources.get(key)
+        if last is not None and now - last[0] < self.refresh_periods.get(name, 0):
+            return last[1]
+        try:
+            value = await fetch_coro_func(*args)
+        except Exception as e:
+            if last is None:
+                raise
+            self.logger.warning(f'failed to refresh {key!r}, using the value from {now - last[0]:.0f} sec ago: {e!r}')
+            return last[1]
+        self._resources[key] = (now, value)
+        return value
+
+    async def fetch(self) -> List[PriceReport]:
+        self.logger.info('start job')
 
-        rank, price_data, p_1h, p_24h, p_7d = await asyncio.gather(
-            self._fetch_rank(),
-            self._fetch_price(),
-            self._fetch_price_history(t_from=now - HOUR - MINUTE * 5, t_to=now - HOUR + MINUTE * 5),
-            self._fetch_price_history(t_from=now - DAY - MINUTE * 15, t_to=now - DAY + MINUTE * 15),
-            self._fetch_price_history(t_from=now - DAY * 7 - HOUR, t_to=now - DAY * 7 + HOUR),
+        ranks, prices = await asyncio.gather(
+            self._refreshed('rank', self._fetch_ranks),
+            self._fetch_prices(),
         )
-        price_data: CoinPriceInfo
-        price_data.rank = rank
+
+        now = now_ts()
+        reports = []
+        for coin in self.coins:
+            price_data = prices.get(coin)
+            if price_data is None:
+                self.logger.warning(f'no price for {coin!r}')
+                continue
+            price_data.rank = ranks.get(coin, 0)
+            reports.append(await self._make_report(coin, price_data, now))
+        return reports
+
+    async def _make_report(self, coin, price_data: CoinPriceInfo, now) -> PriceReport:
+        if price_data.usd > 0:
+            await self.histories[coin].add({'usd': price_data.usd, 'btc': price_data.btc}, now)
+
+        # only our coin shows the 1h/24h/7d changes, the watchlist has just the 24h change from CoinGecko:
+        # no history lookups (and no backfill requests) for it
+        price_change = PriceHistoricalTriplet()
+        if coin == self.primary_coin:
+            p_1h, p_24h, p_7d = await asyncio.gather(
+                self._refreshed('price_1h', self._price_ago, coin, now, HOUR, MINUTE * 5, key=f'price_1h:{coin}'),
+                self._refreshed('price_24h', self._price_ago, coin, now, DAY, MINUTE * 15, key=f'price_24h:{coin}'),
+                self._refreshed('price_7d', self._price_ago, coin, now, DAY * 7, HOUR, key=f'price_7d:{coin}'),
+            )
+            price_change = PriceHistoricalTriplet(price_7d=p_7d, price_24h=p_24h, price_1h=p_1h)
 
         return PriceReport(
             price_and_cap=price_data,
-            price_change=PriceHistoricalTriplet(
-                price_7d=p_7d[0].price,
-                price_24h=p_24h[0].price,
-                price_1h=p_1h[0].price
-            ),
+            price_change=price_change,
             defipulse=DefiPulseEntry(),
             price_ath=PriceATH(),
-            is_ath=False
+            is_ath=False,
+            coin=coin
         )
 
-    async def _fetch_price(self):
-        url = self.COIN_PRICE_GECKO.format(coin=self.ALPHA_GECKO_NAME)
-        async with self.deps.session.get(url) as reps:
-            response_j = await reps.json()
-            result = CoinPriceInfo(**response_j.get(self.ALPHA_GECKO_NAME, {}))
-            self.logger.info(f'got gecko current price {self.ALPHA_GECKO_NAME!r}: {result}')
-            return result
-
-    async def _fetch_rank(self) -> int:
-        url = self.COIN_RANK_GECKO.format(coin=self.ALPHA_GECKO_NAME)
-        async with self.deps.session.get(url) as reps:
-            response_j = await reps.json()
-            rank = int(response_j.get('market_cap_rank', 0))
-            self.logger.info(f'got gecko rank {self.ALPHA_GECKO_NAME!r} -> #{rank}')
-            return rank
-
-    async def _fetch_price_history(self, t_from, t_to) -> List[PriceAndDate]:
-        url = self.COIN_PRICE_HISTORY_GECKO.format(coin=self.ALPHA_GECKO_NAME, t_from=t_from, t_to=t_to)
-        async with self.deps.session.get(url) as reps:
-            response_j = await reps.json()
-            prices = response_j.get('prices', [])
-            self.logger.info(f'got gecko price range {self.ALPHA_GECKO_NAME!r} from {t_from} to {t_to}')
-            return [PriceAndDate(*p) for p in prices]
+    async def _price_ago(self, coin, now, ago, tolerance) -> float:
+        ts = now - ago
+        history = self.histories[coin]
+        point = await history.nearest(ts, tolerance)
+        if point is None:
+            # a gap in the local history (first run or downtime): backfill it from CoinGecko
+            prices = await self._fetch_price_history(coin, t_from=ts - tolerance, t_to=ts + tolerance)
+            points = [TimeSeriesPoint(p.timestamp, {'usd': p.price}) for p in prices]
+            await history.add_many(points)
+            point = nearest_point(points, ts)
+        return float(point.values.get('usd', 0.0)) if point else 0.0
+
+    async def _fetch_prices(self) -> Dict[str, CoinPriceInfo]:
+        chunks = self.chunk_coins(self.COIN_PRICE_GECKO, self.coins)
+        responses = await asyncio.gather(*(
+            self.deps.http.get_json(self.COIN_PRICE_GECKO.format(coins='%2C'.join(chunk))) for chunk in chunks
+        ))
+        result = {}
+        for response_j in responses:
+            for coin, data in response_j.items():
+                result[coin] = CoinPriceInfo(**data)
+        self.logger.info(f'got gecko current prices of {len(result)} coins in {len(chunks)} requests')
+        return result
+
+    async def _fetch_ranks(self) -> Dict[str, int]:
+        chunks = self.chunk_coins(self.COIN_MARKETS_GECKO, self.coins)
+        responses = await asyncio.gather(*(
+            self.deps.http.get_json(self.COIN_MARKETS_GECKO.format(coins='%2C'.join(chunk))) for chunk in chunks
+        ))
+        ranks = {
+            item.get('id'): int(item.get('market_cap_rank') or 0)
+            for response_j in responses for item in response_j
+        }
+        self.logger.info(f'got gecko ranks: {ranks}')
+        return ranks
+
+    async def _fetch_price_history(self, coin, t_from, t_to) -> List[PriceAndDate]:
+        url = self.COIN_PRICE_HISTORY_GECKO.format(coin=coin, t_from=int(t_from), t_to=int(t_to))
+        response_j = await self.deps.http.get_json(url, ttl=0)  # the time range is unique anyway
+        prices = response_j.get('prices', [])
+        self.logger.info(f'got gecko price range {coin!r} from {t_from} to {t_to}')
+        return [PriceAndDate(ts / 1000.0, price) for ts, price in prices]  # ms -> sec
 
 
 class PriceHandler(INotified):
@@ -89,12 +206,15 @@ class PriceHandler(INotified):
 
     def __init__(self, deps: DepContainer):
         self.deps = deps
+        self.logger = logging.getLogger(self.__class__.__name__)
         self.cfg = deps.cfg.notifications.price
         self.stickers = self.cfg.ath.stickers
         self.notification_period = parse_timespan_to_seconds(self.cfg.period)
         self.ath_sticker_iter = circular_shuffled_iterator(self.stickers)
         self.daily_once = OnceADay(self.deps.db, 'PriceDaily')
         self.regular_price_cd = Cooldown(self.deps.db, 'regular_price_notification', self.notification_period)
+        self.alerts = PriceAlertEngine.from_config(deps)
+        self.ath = AtomicMax(deps.db, self.KEY_ATH, field='ath_price', floor=PriceATH().ath_price)
 
     async def get_prev_ath(self) -> PriceATH:
         try:
@@ -110,15 +230,18 @@ class PriceHandler(INotified):
     async def reset_ath(self):
         await self.deps.db.redis.delete(self.KEY_ATH)
 
-    async def update_ath(self, price):
-        last_ath = await self.get_prev_ath()
-        if price and price > 0 and last_ath.is_new_ath(price):
-            await self.deps.db.get_redis()
-            await self.deps.db.redis.set(self.KEY_ATH, PriceATH(
-                int(now_ts()), price
-            ).to_json())
-            return True
-        return False
+    async def update_ath(self, price) -> Tuple[PriceATH, bool]:
+        """
+        :return: the ATH before this price and whether the price is a new ATH
+        """
+        if not price or price <= 0:
+            return await self.get_prev_ath(), False
+        old, updated = await self.ath.update(price, PriceATH(int(now_ts()), price).to_json())
+        try:
+            last_ath = PriceATH.from_json(old) if old else PriceATH()
+        except (TypeError, ValueError, AttributeError):
+            last_ath = PriceATH()
+        return last_ath, updated
 
     async def send_ath_sticker(self):
         if self.ath_sticker_iter:
@@ -126,32 +249,72 @@ class PriceHandler(INotified):
             user_lang_map = self.deps.broadcaster.telegram_chats_from_config(self.deps.loc_man)
             await self.deps.broadcaster.broadcast(user_lang_map.keys(), sticker, message_type=MessageType.STICKER)
 
-    async def send_notification(self, p: PriceReport):
+    async def send_chart(self, chat_ids):
+        chart_cfg = self.cfg.get('chart', {})
+        chart = await self.deps.charts.get_chart(chart_cfg.get('metric', 'price'), chart_cfg.get('window', '7d'))
+        if chart is None:
+            return
+
+        last_board = None
+
+        def take_file_id():
+            if last_board is not None and isinstance(last_board.photo, str):
+                chart.file_id = last_board.photo  # the broadcaster has uploaded it
+
+        async def make_board(_chat_id):
+            # a failed upload has read the stream: every chat gets a fresh one until some upload succeeds
+            nonlocal last_board
+            take_file_id()
+            last_board = BoardMessage.make_photo(chart.as_photo())
+            return last_board
+
+        await self.deps.broadcaster.broadcast(chat_ids, make_board, message_type=MessageType.PHOTO)
+        take_file_id()
+
+    async def send_notification(self, p: PriceReport, watchlist: List[PriceReport] = (), with_chart=False):
         loc_man: LocalizationManager = self.deps.loc_man
-        text = loc_man.default.notification_text_price_update(p)
+        text = loc_man.default.notification_text_price_update(p, watchlist)
         user_lang_map = self.deps.broadcaster.telegram_chats_from_config(self.deps.loc_man)
         await self.deps.broadcaster.broadcast(user_lang_map.keys(), text)
+        if with_chart and self.cfg.get('chart', {}).get('enabled', False):
+            await self.send_chart(user_lang_map.keys())
         if p.is_ath:
             await self.send_ath_sticker()
 
+    async def send_alert(self, p: PriceReport, alert: PriceAlert):
+        loc_man: LocalizationManager = self.deps.loc_man
+        text = loc_man.default.notification_text_price_alert(p, alert)
+        user_lang_map = self.deps.broadcaster.telegram_chats_from_config(self.deps.loc_man)
+        await self.deps.broadcaster.broadcast(user_lang_map.keys(), text)
+
     def _is_it_time_for_regular_message(self):
         h, m = parse_time(self.cfg.time_of_day)
         return is_time_to_do(h, m)
 
-    async def on_data(self, sender, p: PriceReport):
+    async def on_data(self, sender: PriceFetcher, reports: List[PriceReport]):
+        p = next((r for r in reports if r.coin == sender.primary_coin), None)
+        if p is None:
+            self.logger.error(f'no price report of {sender.primary_coin!r}!')
+            return
+        watchlist = [r for r in reports if r is not p]
+
         d: DefiPulseKeeper = self.deps.defipulse
 
         # p.price_and_cap.usd = 3.02  # todo: for ATH debugging
 
         p.defipulse = await d.get_last_state()
-        p.price_ath = await self.get_prev_ath()
-        p.is_ath = (await self.update_ath(p.price_and_cap.usd))
+        p.price_ath, p.is_ath = await self.update_ath(p.price_and_cap.usd)
+
+        alerts = await self.alerts.check(now_ts(), p.price_and_cap.usd)
+        if not p.is_ath:  # the ATH notification tells about the move anyway
+            for alert in alerts:
+                await self.send_alert(p, alert)
 
         if p.is_ath:
-            await self.send_notification(p)
+            await self.send_notification(p, watchlist)
         elif self._is_it_time_for_regular_message():
             if await self.regular_price_cd.can_do():
-                await self.send_notification(p)
+                await self.send_notification(p, watchlist, with_chart=True)
                 await self.regular_price_cd.do()
             # if await self.daily_once.can_do():
             #     await self.send_notification(p)
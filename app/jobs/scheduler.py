@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from jobs.base import BaseFetcher
+
+
+class JobStats:
+    def __init__(self, history=100):
+        self.runs = 0
+        self.errors = 0
+        self.skipped = 0  # ticks when the previous run was still going
+        self.durations = deque(maxlen=history)  # sec
+        self.lateness = deque(maxlen=history)  # sec between the planned tick and the actual start
+
+    def record(self, duration, lateness, ok=True):
+        self.runs += 1
+        self.errors += 0 if ok else 1
+        self.durations.append(duration)
+        self.lateness.append(lateness)
+
+    @staticmethod
+    def _percentiles(values):
+        values = sorted(values)
+        if not values:
+            return {}
+        return {
+            'p50': values[len(values) // 2],
+            'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+            'max': values[-1],
+        }
+
+    def summary(self) -> dict:
+        return {
+            'runs': self.runs,
+            'errors': self.errors,
+            'skipped': self.skipped,
+            'duration': self._percentiles(self.durations),
+            'lateness': self._percentiles(self.lateness),
+        }
+
+
+@dataclass
+class ScheduledJob:
+    fetcher: BaseFetcher
+    period: float
+    jitter: float
+    startup_delay: float
+    stats: JobStats
+    running: Optional[asyncio.Future] = field(default=None, repr=False)
+
+    @property
+    def name(self):
+        return self.fetcher.name
+
+
+class JobScheduler:
+    """
+    Runs BaseFetcher jobs at a fixed rate: the ticks are anchor + n * period (+ random jitter of every tick),
+    so the period does not drift by the time spent in the fetch and its delegates.
+    The anchor is either the monotonic clock (start + startup delay) or the wall clock (multiples of the
+    period since the epoch: an hourly job runs at hh:00).
+    A tick that comes while the previous run of the job is still going is skipped, the missed ticks
+    are not caught up. Every run records its duration and lateness (JobStats).
+    """
+
+    ANCHOR_MONOTONIC = 'monotonic'
+    ANCHOR_WALL = 'wall'
+
+    def __init__(self, anchor=ANCHOR_MONOTONIC, jitter=0.0, history=100, seed=None):
+        assert anchor in (self.ANCHOR_MONOTONIC, self.ANCHOR_WALL), f'unknown anchor: {anchor}'
+        self.anchor = anchor
+        self.jitter = float(jitter)
+        self.history = history
+        self.jobs: List[ScheduledJob] = []
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._rng = random.Random(seed)
+
+    @classmethod
+    def from_config(cls, cfg) -> 'JobScheduler':
+        cfg = cfg.get('scheduler', {})
+        return cls(anchor=cfg.get('anchor', cls.ANCHOR_MONOTONIC),
+                   jitter=cfg.get('jitter', 0.0))
+
+    def add(self, fetcher: BaseFetcher, period=None, jitter=None, startup_delay=None) -> ScheduledJob:
+        """
+        :param period: sec, default is the fetcher's sleep_period
+        :param jitter: sec, every tick is delayed by a random value up to it (at most a half of the period)
+        :param startup_delay: sec, default is the fetcher's startup_sleep
+        """
+        period = float(period if period is not None else fetcher.sleep_period)
+        assert period > 0, 'period must be positive'
+        jitter = float(jitter if jitter is not None else self.jitter)
+        job = ScheduledJob(fetcher, period,
+                           jitter=min(max(0.0, jitter), period / 2),
+                           startup_delay=float(startup_delay if startup_delay is not None else fetcher.startup_sleep),
+                           stats=JobStats(self.history))
+        self.jobs.append(job)
+        return job
+
+    def _now(self):
+        return time.time() if self.anchor == self.ANCHOR_WALL else time.monotonic()
+
+    def _first_tick(self, job: ScheduledJob):
+        start = self._now() + job.startup_delay
+        if self.anchor == self.ANCHOR_WALL:
+            return math.ceil(start / job.period) * job.period
+        return start
+
+    async def _sleep_until(self, t):
+        delay = t - self._now()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _run_once(self, job: ScheduledJob, lateness):
+        t0 = time.monotonic()
+        ok = await job.fetcher.run_once()
+        duration = time.monotonic() - t0
+        job.stats.record(duration, lateness, ok)
+        self.logger.debug(f'{job.name}: run #{job.stats.runs} took {duration:.3f} sec, {lateness:.3f} sec late')
+
+    async def _run_job(self, job: ScheduledJob):
+        anchor = self._first_tick(job)
+        self.logger.info(f'{job.name}: every {job.period} sec (jitter {job.jitter} sec, {self.anchor} clock)')
+        n = 0
+        while True:
+            planned = anchor + n * job.period + (self._rng.uniform(0.0, job.jitter) if job.jitter else 0.0)
+            await self._sleep_until(planned)
+
+            if job.running is not None and not job.running.done():
+                job.stats.skipped += 1
+                self.logger.warning(f'{job.name}: the previous run is still going, tick #{n} skipped')
+            else:
+                job.running = asyncio.ensure_future(self._run_once(job, self._now() - planned))
+
+            n = max(n + 1, math.floor((self._now() - anchor) / job.period) + 1)
+
+    async def run(self):
+        try:
+            await asyncio.gather(*(self._run_job(job) for job in self.jobs))
+        finally:
+            for job in self.jobs:
+                if job.running is not None:
+                    job.running.cancel()
+
+    def report(self) -> dict:
+        return {job.name: job.stats.summary() for job in self.jobs}
@@ -0,0 +1,21 @@
+from jobs.base import BaseFetcher
+from lib.datetime import MINUTE
+from lib.depcont import DepContainer
+
+
+class StatsReporter(BaseFetcher):
+    """
+    Logs the render engine's queue depth and job timings (and the background jobs' timings) periodically
+    """
+
+    def __init__(self, deps: DepContainer, period=10 * MINUTE):
+        super().__init__(deps, period)
+
+    async def fetch(self):
+        if self.deps.render_engine is not None:
+            stats = self.deps.render_engine.stats()
+            self.logger.info('render engine: ' + ', '.join(
+                f'{k} {v:.3f}' if isinstance(v, float) else f'{k} {v}' for k, v in stats.items()))
+        if self.deps.scheduler is not None:
+            for name, summary in self.deps.scheduler.report().items():
+                self.logger.info(f'job {name}: {summary}')
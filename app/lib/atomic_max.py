@@ -0,0 +1,64 @@
+import hashlib
+from typing import Optional, Tuple
+
+from aioredis import ReplyError
+
+from lib.db import DB
+
+# KEYS[1] = record key
+# ARGV = new value, new record, JSON field of the value in the record ('' = the record is the number itself), floor
+# returns {previous record or '', 1 if updated else 0}
+_UPDATE_MAX_SCRIPT = """
+local old = redis.call('GET', KEYS[1])
+local value = tonumber(ARGV[1])
+local best
+if old then
+    if ARGV[3] ~= '' then
+        local ok, decoded = pcall(cjson.decode, old)
+        if ok and type(decoded) == 'table' then
+            best = tonumber(decoded[ARGV[3]])
+        end
+    else
+        best = tonumber(old)
+    end
+end
+if best == nil then
+    best = tonumber(ARGV[4])
+end
+if value ~= nil and value > best then
+    redis.call('SET', KEYS[1], ARGV[2])
+    return {old or '', 1}
+end
+return {old or '', 0}
+"""
+
+
+class AtomicMax:
+    """
+    "New maximum" compare-and-set in one round trip: the record is replaced only if the value beats the stored one.
+    The stored value is either the record itself (a number) or its JSON field; "floor" is used if there is none.
+    """
+
+    SCRIPT_SHA = hashlib.sha1(_UPDATE_MAX_SCRIPT.encode('utf-8')).hexdigest()
+
+    def __init__(self, db: DB, key, field: Optional[str] = None, floor=0.0):
+        self.db = db
+        self.key = key
+        self.field = field
+        self.floor = floor
+
+    async def update(self, value, record=None) -> Tuple[Optional[bytes], bool]:
+        """
+        :param record: what to store if the value is a new maximum, the value itself by default
+        :return: the previous record (None if there was none) and whether it has been replaced
+        """
+        r = await self.db.get_redis()
+        keys = [self.key]
+        args = [float(value), value if record is None else record, self.field or '', float(self.floor)]
+        try:
+            old, updated = await r.evalsha(self.SCRIPT_SHA, keys=keys, args=args)
+        except ReplyError as e:
+            if 'NOSCRIPT' not in str(e):
+                raise
+            old, updated = await r.eval(_UPDATE_MAX_SCRIPT, keys=keys, args=args)  # caches the script as well
+        return (old or None), bool(updated)
@@ -4,6 +4,7 @@ import random
 import time
 from typing import Iterable
 
+from aiogram.types import Message, InputFile
 from aiogram.utils import exceptions
 
 from lib.depcont import DepContainer
@@ -52,23 +53,24 @@ class Broadcaster:
                 del kwargs['disable_notification']
         return kwargs
 
-    async def _send_message(self, chat_id, text, message_type=MessageType.TEXT, *args, **kwargs) -> bool:
+    async def _send_message(self, chat_id, text, message_type=MessageType.TEXT, *args, **kwargs):
         """
         Safe messages sender
         :param chat_id:
         :param text:
         :param disable_notification:
-        :return:
+        :return: the sent Message (or True if it failed, but not because of the user), False if the user is gone
         """
+        sent = None
         try:
             if message_type == MessageType.TEXT:
-                await self.bot.send_message(chat_id, text, *args, **kwargs)
+                sent = await self.bot.send_message(chat_id, text, *args, **kwargs)
             elif message_type == MessageType.STICKER:
                 kwargs = self.remove_bad_args(kwargs, dis_web_preview=True)
-                await self.bot.send_sticker(chat_id, sticker=text, *args, **kwargs)
+                sent = await self.bot.send_sticker(chat_id, sticker=text, *args, **kwargs)
             elif message_type == MessageType.PHOTO:
                 kwargs = self.remove_bad_args(kwargs, dis_web_preview=True)
-                await self.bot.send_photo(chat_id, caption=text, *args, **kwargs)
+                sent = await self.bot.send_photo(chat_id, caption=text, *args, **kwargs)
         except exceptions.BotBlocked:
             self.logger.error(f"Target [ID:{chat_id}]: blocked by user")
         except exceptions.ChatNotFound:
@@ -76,6 +78,9 @@ class Broadcaster:
         except exceptions.RetryAfter as e:
             self.logger.error(f"Target [ID:{chat_id}]: Flood limit is exceeded. Sleep {e.timeout} seconds.")
             await asyncio.sleep(e.timeout + 0.1)
+            photo = kwargs.get('photo')
+            if isinstance(photo, InputFile) and photo.file.seekable():
+                photo.file.seek(0)  # the failed attempt has read the upload
             return await self._send_message(chat_id, text, message_type=message_type, *args, **kwargs)  # Recursive call
         except exceptions.UserDeactivated:
             self.logger.error(f"Target [ID:{chat_id}]: user is deactivated")
@@ -84,7 +89,7 @@ class Broadcaster:
             return True  # tg error is not the reason to exclude the user
         else:
             self.logger.info(f"Target [ID:{chat_id}]: success")
-            return True
+            return sent or True
         return False
 
     def sort_and_shuffle_chats(self, chat_ids):
@@ -121,23 +126,32 @@ class Broadcaster:
 
                 for chat_id in chat_ids:
                     extra = {}
+                    board = None
                     if isinstance(message, str):
                         text = message
+                    elif isinstance(message, BoardMessage):
+                        board = message
                     elif callable(message):
-                        message = await message(chat_id, *args, **kwargs)
-                        if isinstance(message, BoardMessage):
-                            message_type = message.message_type
-                            if message.message_type is MessageType.PHOTO:
-                                extra['photo'] = message.photo
-                            text = message.text
+                        generated = await message(chat_id, *args, **kwargs)
+                        if isinstance(generated, BoardMessage):
+                            board = generated
                         else:
-                            text = message
+                            text = generated
+
+                    if board is not None:
+                        message_type = board.message_type
+                        if board.message_type is MessageType.PHOTO:
+                            extra['photo'] = board.photo
+                        text = board.text
 
                     if text or 'photo' in extra:
-                        if await self._send_message(chat_id, text, message_type=message_type,
-                                                    disable_web_page_preview=True,
-                                                    disable_notification=False, **extra):
+                        sent = await self._send_message(chat_id, text, message_type=message_type,
+                                                        disable_web_page_preview=True,
+                                                        disable_notification=False, **extra)
+                        if sent:
                             count += 1
+                            if 'photo' in extra and isinstance(sent, Message) and not isinstance(board.photo, str):
+                                board.photo = sent.photo[-1].file_id  # upload once, then send by file_id
                         else:
                             bad_ones.append(chat_id)
                         await asyncio.sleep(delay)  # 10 messages per second (Limit: 30 messages per second)
@@ -0,0 +1,76 @@
+from io import BytesIO
+from typing import List, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+CHART_SIZE = (800, 400)
+CHART_BG = (20, 22, 30)
+CHART_GRID = (48, 52, 66)
+CHART_TEXT = (220, 222, 230)
+CHART_UP = (60, 200, 120)
+CHART_DOWN = (230, 80, 80)
+
+
+def bucketize(points: List[Tuple[float, float]], bucket) -> List[Tuple[float, float]]:
+    """
+    The last (timestamp, value) of every "bucket" seconds, in time order
+    """
+    result = {}
+    for ts, value in sorted(points):
+        result[int(ts // bucket) if bucket else ts] = (ts, value)
+    return list(result.values())
+
+
+def render_sparkline(points: List[Tuple[float, float]], title, value_format='{:,.2f}', size=CHART_SIZE,
+                     invert=False) -> bytes:
+    """
+    Line chart of (timestamp, value) with the area under it, the low, the high and the last value as PNG
+    :param invert: a smaller value is better (e.g. a rank): the Y axis goes down and a fall is drawn green
+    """
+    width, height = size
+    pad_l, pad_r, pad_t, pad_b = 16, 16, 40, 28
+
+    im = Image.new('RGB', size, CHART_BG)
+    draw = ImageDraw.Draw(im)
+    font = ImageFont.load_default()
+
+    for i in range(5):
+        y = pad_t + (height - pad_t - pad_b) * i // 4
+        draw.line([(pad_l, y), (width - pad_r, y)], fill=CHART_GRID)
+
+    draw.text((pad_l, 12), title, fill=CHART_TEXT, font=font)
+    if len(points) < 2:
+        draw.text((pad_l, height // 2), 'not enough data yet', fill=CHART_TEXT, font=font)
+        return _to_png(im)
+
+    t0, t1 = points[0][0], points[-1][0]
+    values = [v for _, v in points]
+    lo, hi = min(values), max(values)
+    span_t = (t1 - t0) or 1.0
+    span_v = (hi - lo) or (abs(hi) or 1.0)
+
+    def xy(ts, value):
+        x = pad_l + (ts - t0) / span_t * (width - pad_l - pad_r)
+        share = (hi - value if invert else value - lo) / span_v
+        y = height - pad_b - share * (height - pad_t - pad_b)
+        return x, y
+
+    line = [xy(ts, v) for ts, v in points]
+    improved = values[-1] <= values[0] if invert else values[-1] >= values[0]
+    color = CHART_UP if improved else CHART_DOWN
+    area_color = tuple(c // 3 + b * 2 // 3 for c, b in zip(color, CHART_BG))
+    draw.polygon(line + [(line[-1][0], height - pad_b), (line[0][0], height - pad_b)], fill=area_color)
+    draw.line(line, fill=color, width=3)
+
+    last = value_format.format(values[-1])
+    change = (values[-1] - values[0]) / values[0] * 100.0 if values[0] else 0.0
+    draw.text((width // 2, 12), f'{last}  ({change:+.2f} %)', fill=color, font=font)
+    draw.text((pad_l, height - pad_b + 8),
+              f'low {value_format.format(lo)}   high {value_format.format(hi)}', fill=CHART_TEXT, font=font)
+    return _to_png(im)
+
+
+def _to_png(im: Image.Image) -> bytes:
+    bio = BytesIO()
+    im.save(bio, 'PNG', optimize=False, compress_level=3)
+    return bio.getvalue()
@@ -13,13 +13,20 @@ class DepContainer:
     loop: typing.Optional[asyncio.BaseEventLoop] = None
 
     session: typing.Optional[ClientSession] = None
+    http: typing.Optional['HttpClient'] = None
 
     bot: typing.Optional['Bot'] = None
     dp: typing.Optional['Dispatcher'] = None
     broadcaster: typing.Optional['Broadcaster'] = None
     loc_man: typing.Optional['LocalizationManager'] = None
 
+    scheduler: typing.Optional['JobScheduler'] = None
     defipulse: typing.Optional['DefiPulsePersistance'] = None
+    charts: typing.Optional['ChartKeeper'] = None
+
+    render_engine: typing.Optional['RenderEngine'] = None
+    avatar_cache: typing.Optional['AvatarResultCache'] = None
+    user_limiter: typing.Optional['UserConcurrencyLimiter'] = None
 
     def __repr__(self) -> str:
         return 'DepContainer()'
@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class DiskBlobCache:
+    """
+    Size-bounded content-addressed blob storage on disk.
+    Blobs are named by the SHA-256 of their content, the least recently used ones are evicted first.
+    Access order survives restarts through the file mtime.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # digest -> size, LRU order
+        self.total_bytes = 0
+        self._scan()
+
+    @staticmethod
+    def digest(data: bytes):
+        return hashlib.sha256(data).hexdigest()
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _scan(self):
+        os.makedirs(self.root, exist_ok=True)
+        entries = []
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if file_name.endswith('.tmp'):
+                    continue
+                st = os.stat(os.path.join(dir_path, file_name))
+                entries.append((st.st_mtime, file_name, st.st_size))
+        for _, digest, size in sorted(entries):
+            self._index[digest] = size
+            self.total_bytes += size
+        self._evict()
+
+    def get(self, digest) -> Optional[bytes]:
+        with self._lock:
+            if digest not in self._index:
+                return None
+            self._index.move_to_end(digest)
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            with self._lock:
+                self.total_bytes -= self._index.pop(digest, 0)
+            return None
+
+    def put(self, data: bytes):
+        digest = self.digest(data)
+        with self._lock:
+            if digest in self._index:
+                self._index.move_to_end(digest)
+                return digest
+
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if digest not in self._index:
+                self._index[digest] = len(data)
+                self.total_bytes += len(data)
+            self._evict()
+        return digest
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._index:
+            digest, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(digest))
+            except FileNotFoundError:
+                pass
+            self.logger.debug(f'evicted {digest} ({size} bytes)')
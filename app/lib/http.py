@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, AsyncIterator, AsyncIterable
+from urllib.parse import urlparse
+
+from aiohttp import ClientSession, ClientTimeout
+
+from lib.datetime import now_ts
+from lib.http_record import HttpRecorder
+
+
+class HttpError(Exception):
+    def __init__(self, url, status, message=''):
+        super().__init__(f'HTTP {status} for {url} {message}'.strip())
+        self.url = url
+        self.status = status
+
+
+class RateLimited(HttpError):
+    def __init__(self, url, status, retry_after):
+        super().__init__(url, status, f'(retry after {retry_after:.0f} sec)')
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value, default=60.0) -> float:
+    """
+    Retry-After header: either delay in seconds or an HTTP date
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now_ts())
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """
+    Allows "rate" requests per second on average with bursts up to "capacity"
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:  # first come, first served
+            while True:
+                self._refill(time.monotonic())
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+class HttpClient:
+    """
+    JSON GET requests for all the data fetchers:
+        - responses are cached for "cache_ttl" seconds;
+        - concurrent requests of the same URL share one real request (single flight);
+        - every host has its own token bucket (rate_limits: {host: {per_minute, burst}});
+        - 429/503 pauses all requests to the host for Retry-After seconds, then retries (up to "max_retries");
+        - non-2xx statuses raise HttpError;
+        - "rewrites" {url prefix: new prefix} send the requests elsewhere, e.g. to tools/replay_server.py
+          (rate limits still apply to the original hosts);
+        - with a "recorder" every successful response is written to disk for the replay.
+    """
+
+    def __init__(self, session: ClientSession, timeout=10.0, cache_ttl=30.0, cache_size=256, max_retries=2,
+                 rate_limits: Optional[Dict[str, dict]] = None, rewrites: Optional[Dict[str, str]] = None,
+                 recorder: Optional[HttpRecorder] = None):
+        self.session = session
+        self.timeout = ClientTimeout(total=float(timeout))
+        self.cache_ttl = float(cache_ttl)
+        self.cache_size = int(cache_size)
+        self.max_retries = int(max_retries)
+        self.rate_limits = dict(rate_limits or {})
+        self.rewrites = dict(rewrites or {})
+        self.recorder = recorder
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self._cache = OrderedDict()  # url -> (expires_at, data)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._buckets: Dict[str, Optional[TokenBucket]] = {}
+        self._paused_until: Dict[str, float] = {}  # host -> monotonic time
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_config(cls, session: ClientSession, cfg) -> 'HttpClient':
+        cfg = cfg.get('http', {})
+        record_dir = cfg.get('record_dir')
+        return cls(session,
+                   timeout=cfg.get('timeout', 10.0),
+                   cache_ttl=cfg.get('cache_ttl', 30.0),
+                   max_retries=cfg.get('max_retries', 2),
+                   rate_limits=cfg.get('rate_limits', {}),
+                   rewrites=cfg.get('rewrite', {}),
+                   recorder=HttpRecorder(record_dir) if record_dir else None)
+
+    def _rewrite(self, url):
+        for prefix, replacement in self.rewrites.items():
+            if url.startswith(prefix):
+                return replacement + url[len(prefix):]
+        return url
+
+    def _bucket(self, host) -> Optional[TokenBucket]:
+        if host not in self._buckets:
+            limit = self.rate_limits.get(host)
+            self._buckets[host] = TokenBucket(rate=float(limit.get('per_minute', 60)) / 60.0,
+                                              capacity=limit.get('burst', 1)) if limit else None
+        return self._buckets[host]
+
+    def _cached(self, url):
+        entry = self._cache.get(url)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if time.monotonic() > expires_at:
+            del self._cache[url]
+            return None
+        self._cache.move_to_end(url)
+        return entry
+
+    def _store(self, url, data, ttl):
+        if ttl <= 0:
+            return
+        self._cache[url] = (time.monotonic() + ttl, data)
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def get_json(self, url, ttl=None):
+        """
+        :param ttl: cache time of this response in seconds, 0 = always a fresh one; default is "cache_ttl"
+        """
+        ttl = self.cache_ttl if ttl is None else float(ttl)
+        entry = self._cached(url) if ttl > 0 else None
+        if entry is not None:
+            self.cache_hits += 1
+            return entry[1]
+
+        in_flight = self._in_flight.get(url)
+        if in_flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight)
+
+        task = asyncio.ensure_future(self._fetch_json(url))
+        self._in_flight[url] = task
+        try:
+            data = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._in_flight.pop(url, None)
+            else:
+                task.add_done_callback(lambda _: self._in_flight.pop(url, None))
+        self._store(url, data, ttl)
+        return data
+
+    async def _wait_for_host(self, host):
+        while True:
+            delay = self._paused_until.get(host, 0.0) - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        bucket = self._bucket(host)
+        if bucket is not None:
+            await bucket.acquire()
+
+    def _pause_host(self, host, seconds):
+        self._paused_until[host] = max(self._paused_until.get(host, 0.0), time.monotonic() + seconds)
+
+    @asynccontextmanager
+    async def _request(self, url):
+        host = urlparse(url).hostname
+        target_url = self._rewrite(url)
+        attempt = 0
+        while True:
+            await self._wait_for_host(host)
+            self.requests += 1
+            async with self.session.get(target_url, timeout=self.timeout) as resp:
+                if resp.status in (429, 503):
+                    retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                    self._pause_host(host, retry_after)
+                    self.logger.warning(f'{host} answered {resp.status}, retry after {retry_after:.0f} sec')
+                    if attempt >= self.max_retries:
+                        raise RateLimited(url, resp.status, retry_after)
+                    attempt += 1
+                    continue
+                if not 200 <= resp.status < 300:
+                    raise HttpError(url, resp.status, (await resp.text())[:200])
+                yield resp
+                return
+
+    async def _fetch_json(self, url):
+        async with self._request(url) as resp:
+            body = await resp.read()
+            self._record(url, resp, body)
+            return json.loads(body)
+
+    def _record(self, url, resp, body: bytes):
+        if self.recorder is not None:
+            self.recorder.save(url, resp.status, resp.content_type, body)
+
+    @asynccontextmanager
+    async def stream(self, url, chunk_size=64 * 1024) -> AsyncIterator[AsyncIterable[bytes]]:
+        """
+        The response body as an async iterator of byte chunks; it is neither cached nor shared.
+        Leaving the context early drops the rest of the body.
+        When recording, the whole body is read first and then served from memory.
+        """
+        async with self._request(url) as resp:
+            if self.recorder is None:
+                yield resp.content.iter_chunked(chunk_size)
+                return
+
+            body = await resp.read()
+            self._record(url, resp, body)
+
+            async def chunks():
+                for i in range(0, len(body), chunk_size):
+                    yield body[i:i + chunk_size]
+
+            yield chunks()
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import random
+from collections import defaultdict, Counter
+from dataclasses import dataclass
+from typing import Dict, List
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from aiohttp import web
+
+from lib.datetime import now_ts
+
+# query parameters that are never written to disk
+SECRET_PARAMS = {'api-key', 'api_key', 'apikey', 'key', 'token', 'x_cg_pro_api_key'}
+# time windows, different in every request (e.g. market_chart/range): a replay could never match them
+VOLATILE_PARAMS = {'from', 'to'}
+
+
+def recording_key(url) -> str:
+    """
+    "host/path?query" without the scheme, the secrets and the time windows, the query is sorted.
+    Requests that differ only in these details share one recording.
+    """
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in SECRET_PARAMS | VOLATILE_PARAMS)
+    key = f'{parts.hostname}{parts.path}'
+    return f'{key}?{urlencode(query)}' if query else key
+
+
+@dataclass
+class Recording:
+    key: str
+    status: int
+    content_type: str
+    recorded_at: float
+    body: bytes
+
+
+class HttpRecorder:
+    """
+    Writes the responses of HttpClient to a directory, one JSON file per response:
+    {key}-{sequence}.json with the key, status, content type, time and the body as text.
+    The same URL recorded again gets the next sequence number, so the replay can follow the changes.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._counter = itertools.count(len(os.listdir(directory)))
+        self.saved = 0
+
+    @staticmethod
+    def _file_prefix(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    def save(self, url, status, content_type, body: bytes):
+        key = recording_key(url)
+        path = os.path.join(self.directory, f'{self._file_prefix(key)}-{next(self._counter):06d}.json')
+        with open(path, 'w') as f:
+            json.dump({
+                'key': key,
+                'status': status,
+                'content_type': content_type,
+                'recorded_at': now_ts(),
+                'body': body.decode('utf-8'),
+            }, f)
+        self.saved += 1
+        return path
+
+
+def load_recordings(directory) -> Dict[str, List[Recording]]:
+    """
+    :return: key -> the recordings of it in the recording order
+    """
+    result = defaultdict(list)
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(directory, name), 'r') as f:
+            j = json.load(f)
+        result[j['key']].append(Recording(j['key'], int(j['status']), j.get('content_type', 'application/json'),
+                                          float(j.get('recorded_at', 0.0)), j['body'].encode('utf-8')))
+    for recordings in result.values():
+        recordings.sort(key=lambda rec: rec.recorded_at)
+    return dict(result)
+
+
+class ReplayServer:
+    """
+    aiohttp stand-in for the recorded APIs. A request to /{host}/{path}?{query} gets the recordings of
+    "https://{host}/{path}?{query}" one after another (then from the beginning again).
+    It adds latency (seconds, uniform in [latency - jitter, latency + jitter]), 500 errors and 429s with
+    Retry-After at the given rates. The randomness is seeded, so a run is repeatable.
+    Point HttpClient at it with rewrites={'https://api.coingecko.com': 'http://127.0.0.1:8765/api.coingecko.com'}
+    """
+
+    def __init__(self, recordings: Dict[str, List[Recording]], latency=0.0, jitter=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, seed=0):
+        self.recordings = recordings
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.error_rate = float(error_rate)
+        self.rate_limit_rate = float(rate_limit_rate)
+        self.retry_after = float(retry_after)
+        self._rng = random.Random(seed)
+        self._cursors = Counter()
+        self.stats = Counter()
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/_stats', self.handle_stats)
+        app.router.add_get('/{path:.+}', self.handle)
+        return app
+
+    async def handle_stats(self, request: web.Request):
+        return web.json_response(dict(self.stats))
+
+    async def handle(self, request: web.Request):
+        response = self._respond(recording_key('https://' + request.path_qs.lstrip('/')))
+        delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+        if delay:
+            await asyncio.sleep(delay)
+        return response
+
+    def _respond(self, key) -> web.Response:
+        # everything is decided before the first await, so the sequence does not depend on the timing
+        self.stats['requests'] += 1
+        roll = self._rng.random()
+        recordings = self.recordings.get(key)
+        if not recordings:
+            self.stats['not_found'] += 1
+            return web.Response(status=404, text=f'no recording of {key}')
+        if roll < self.rate_limit_rate:
+            self.stats['rate_limited'] += 1
+            return web.Response(status=429, headers={'Retry-After': f'{self.retry_after:g}'})
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.stats['errors'] += 1
+            return web.Response(status=500, text='injected error')
+
+        recording = recordings[self._cursors[key] % len(recordings)]
+        self._cursors[key] += 1
+        self.stats['replayed'] += 1
+        return web.Response(status=recording.status, body=recording.body, content_type=recording.content_type)
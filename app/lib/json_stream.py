@@ -0,0 +1,84 @@
+import codecs
+import json
+import re
+from typing import Callable, Iterable, AsyncIterable, Iterator, Optional, Tuple
+
+# from a position outside of any string: text with complete strings up to the next brace (inclusive)
+_TO_NEXT_BRACE = re.compile(r'[^{}"]*(?:"(?:[^"\\]|\\.)*"[^{}"]*)*[{}]', re.DOTALL)
+
+ArrayItem = Tuple[int, Optional[str], Optional[str]]  # (1-based position, "key" value, raw JSON text or None)
+
+
+class JsonArrayScanner:
+    """
+    Incremental scanner of a top-level JSON array of objects, fed with text chunks.
+    For every object it reports its position and the string value of one of its top-level keys (e.g. "name").
+    The object text is cut out only if wanted(value) is true, the rest is skipped without building anything:
+    the scanner hops from brace to brace and looks at the top level text of the objects only.
+    """
+
+    def __init__(self, key='name', wanted: Callable[[Optional[str]], bool] = lambda value: True):
+        self.key = key
+        self.wanted = wanted
+        self.position = 0
+        self._key_re = re.compile(r'"%s"\s*:\s*("(?:[^"\\]|\\.)*")' % re.escape(key), re.DOTALL)
+        self._buf = ''
+        self._pos = 0
+        self._depth = 0  # of braces, the array items are at 1
+        self._item_start = -1
+        self._value = None
+
+    def feed(self, text: str) -> Iterator[ArrayItem]:
+        # drop what has been scanned, but keep the unfinished object
+        keep = self._item_start if self._item_start >= 0 else self._pos
+        buf = self._buf = self._buf[keep:] + text
+        pos = self._pos - keep
+        if self._item_start >= 0:
+            self._item_start = 0
+
+        depth = self._depth
+        hop = _TO_NEXT_BRACE.match
+        while True:
+            m = hop(buf, pos)
+            if m is None:
+                break  # no brace or an unfinished string: wait for the next chunk
+            end = m.end()
+            if depth == 1 and self._value is None:
+                found = self._key_re.search(buf, pos, end - 1)  # the object's own keys, not the nested ones
+                if found:
+                    self._value = json.loads(found.group(1))
+
+            if buf[end - 1] == '{':
+                if depth == 0:
+                    self._item_start = end - 1
+                    self._value = None
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    self.position += 1
+                    raw = buf[self._item_start:end] if self.wanted(self._value) else None
+                    self._item_start = -1
+                    self._depth, self._pos = depth, end
+                    yield self.position, self._value, raw
+            pos = end
+
+        self._depth, self._pos = depth, pos
+
+
+def iter_array_items(chunks: Iterable[str], key='name', wanted=lambda value: True) -> Iterator[ArrayItem]:
+    scanner = JsonArrayScanner(key, wanted)
+    for chunk in chunks:
+        yield from scanner.feed(chunk)
+
+
+async def aiter_array_items(chunks: AsyncIterable[bytes], key='name', wanted=lambda value: True,
+                            encoding='utf-8') -> AsyncIterable[ArrayItem]:
+    """
+    Same over a byte stream, e.g. aiohttp response.content.iter_chunked(n)
+    """
+    scanner = JsonArrayScanner(key, wanted)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    async for chunk in chunks:
+        for item in scanner.feed(decoder.decode(chunk)):
+            yield item
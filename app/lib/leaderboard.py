@@ -0,0 +1,139 @@
+import struct
+from dataclasses import dataclass
+from typing import List, Iterable
+
+import numpy as np
+
+_HEADER = struct.Struct('<4sIqI')  # magic, number of projects, timestamp, length of the names block
+_MAGIC = b'LB01'
+_NAMES_SEP = '\x00'
+
+
+@dataclass
+class LeaderboardSnapshot:
+    """
+    The whole leaderboard of one fetch as columns: ids, ranks and TVL of every project (in rank order)
+    Stored as one binary blob: header, int64 ids, int32 ranks, float64 TVL, then the names.
+    """
+    timestamp: int
+    ids: np.ndarray
+    ranks: np.ndarray
+    tvl: np.ndarray
+    names: List[str]
+
+    @classmethod
+    def from_entries(cls, entries: Iterable, timestamp) -> 'LeaderboardSnapshot':
+        """
+        :param entries: objects with "id", "rank", "tlv_usd" and "name", e.g. DefiPulseEntry
+        """
+        entries = sorted(entries, key=lambda e: e.rank)
+        return cls(
+            timestamp=int(timestamp),
+            ids=np.fromiter((e.id for e in entries), dtype=np.int64, count=len(entries)),
+            ranks=np.fromiter((e.rank for e in entries), dtype=np.int32, count=len(entries)),
+            tvl=np.fromiter((e.tlv_usd for e in entries), dtype=np.float64, count=len(entries)),
+            names=[e.name for e in entries],
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def to_bytes(self) -> bytes:
+        names = _NAMES_SEP.join(self.names).encode('utf-8')
+        return b''.join((
+            _HEADER.pack(_MAGIC, len(self), self.timestamp, len(names)),
+            self.ids.astype('<i8').tobytes(),
+            self.ranks.astype('<i4').tobytes(),
+            self.tvl.astype('<f8').tobytes(),
+            names,
+        ))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'LeaderboardSnapshot':
+        magic, n, timestamp, names_len = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError(f'not a leaderboard snapshot: {magic!r}')
+        offset = _HEADER.size
+        ids = np.frombuffer(data, dtype='<i8', count=n, offset=offset)
+        offset += ids.nbytes
+        ranks = np.frombuffer(data, dtype='<i4', count=n, offset=offset)
+        offset += ranks.nbytes
+        tvl = np.frombuffer(data, dtype='<f8', count=n, offset=offset)
+        offset += tvl.nbytes
+        names = data[offset:offset + names_len].decode('utf-8')
+        return cls(timestamp, ids, ranks, tvl, names.split(_NAMES_SEP) if n else [])
+
+
+@dataclass
+class LeaderboardDiff:
+    """
+    Projects present in both snapshots, in the current rank order.
+    rank_delta < 0 means the project went up.
+    """
+    ids: np.ndarray
+    names: List[str]
+    rank_prev: np.ndarray
+    rank_now: np.ndarray
+    tvl_prev: np.ndarray
+    tvl_now: np.ndarray
+    new_ids: np.ndarray  # appeared in the leaderboard
+    gone_ids: np.ndarray  # disappeared from it
+
+    @property
+    def rank_delta(self) -> np.ndarray:
+        return self.rank_now - self.rank_prev
+
+    @property
+    def tvl_change(self) -> np.ndarray:
+        """
+        TVL change in %, 0 for the projects without the previous TVL
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = (self.tvl_now - self.tvl_prev) / self.tvl_prev * 100.0
+        return np.where(self.tvl_prev > 0, change, 0.0)
+
+    def _names(self, mask) -> List[str]:
+        return [self.names[i] for i in np.flatnonzero(mask)]
+
+    def overtook(self, project_id) -> List[str]:
+        """
+        Projects that were below the project and are above it now
+        """
+        me = np.flatnonzero(self.ids == project_id)
+        if not len(me):
+            return []
+        me = me[0]
+        return self._names((self.rank_prev > self.rank_prev[me]) & (self.rank_now < self.rank_now[me]))
+
+    def overtaken_by(self, project_id) -> List[str]:
+        """
+        Projects that were above the project and are below it now
+        """
+        me = np.flatnonzero(self.ids == project_id)
+        if not len(me):
+            return []
+        me = me[0]
+        return self._names((self.rank_prev < self.rank_prev[me]) & (self.rank_now > self.rank_now[me]))
+
+    def top_movers(self, n=5) -> List[str]:
+        """
+        Names of the projects with the largest TVL changes (either way), the largest first
+        """
+        order = np.argsort(-np.abs(self.tvl_change), kind='stable')[:n]
+        return [self.names[i] for i in order]
+
+
+def diff_snapshots(prev: LeaderboardSnapshot, cur: LeaderboardSnapshot) -> LeaderboardDiff:
+    _, i_cur, i_prev = np.intersect1d(cur.ids, prev.ids, assume_unique=True, return_indices=True)
+    order = np.argsort(cur.ranks[i_cur], kind='stable')
+    i_cur, i_prev = i_cur[order], i_prev[order]
+    return LeaderboardDiff(
+        ids=cur.ids[i_cur],
+        names=[cur.names[i] for i in i_cur],
+        rank_prev=prev.ranks[i_prev],
+        rank_now=cur.ranks[i_cur],
+        tvl_prev=prev.tvl[i_prev],
+        tvl_now=cur.tvl[i_cur],
+        new_ids=np.setdiff1d(cur.ids, prev.ids, assume_unique=True),
+        gone_ids=np.setdiff1d(prev.ids, cur.ids, assume_unique=True),
+    )
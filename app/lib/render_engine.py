@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+JobTiming = namedtuple('JobTiming', ('wait', 'run'))
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+def _noop():
+    pass
+
+
+class RenderEngine:
+    """
+    Runs CPU-heavy jobs in a dedicated process pool.
+    At most "workers" jobs run at once, at most "max_queue" wait for a free worker, the rest are rejected.
+    workers=0 falls back to the default thread executor of the loop (handy for debugging).
+    A worker that dies (e.g. killed for memory) breaks the pool: it is replaced with a fresh one and the job
+    is tried once more there, so the other jobs are not affected.
+    """
+
+    def __init__(self, workers=2, max_queue=20, initializer=None, initargs=(), history_size=100):
+        self.workers = max(0, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self.initializer = initializer
+        self.initargs = initargs
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(max(1, self.workers))
+        self._pending = 0
+        self._in_progress = 0
+        self.timings = deque(maxlen=history_size)
+        self.total_jobs = 0
+        self.rejected_jobs = 0
+        self.broken_pools = 0
+
+    @property
+    def capacity(self):
+        return max(1, self.workers)
+
+    @property
+    def queue_depth(self):
+        return self._pending - self._in_progress
+
+    @property
+    def in_progress(self):
+        return self._in_progress
+
+    def start(self):
+        """
+        Forks the workers now, at startup, while the bot has no other threads (and locks held by them)
+        """
+        pool = self._get_pool()
+        if pool is not None:
+            for _ in range(self.workers):
+                pool.submit(_noop)
+
+    def _get_pool(self):
+        if self.workers and self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             initializer=self.initializer, initargs=self.initargs)
+            self.logger.info(f'started render pool with {self.workers} processes')
+        return self._pool
+
+    def _reset_pool(self, broken_pool):
+        if self._pool is broken_pool:  # the other jobs of the same pool find it replaced already
+            self._pool = None
+            broken_pool.shutdown(wait=False)
+            self.broken_pools += 1
+            self.logger.error('render pool is broken (a worker died), starting a new one')
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                return await loop.run_in_executor(pool, func, *args)
+            except BrokenProcessPool:
+                self._reset_pool(pool)
+                if attempt:
+                    raise
+
+    async def submit(self, func, *args, on_wait=None):
+        """
+        Runs func(*args) in the pool and returns its result
+        :param func: picklable module level function
+        :param on_wait: optional coroutine function, called with the position in line if the job has to wait
+        :raises RenderQueueFull: if there are already too many jobs waiting
+        :raises BrokenProcessPool: if the job breaks a fresh pool too
+        """
+        if self._pending >= self.capacity + self.max_queue:
+            self.rejected_jobs += 1
+            raise RenderQueueFull(f'render queue is full ({self.queue_depth} jobs waiting)')
+
+        self._pending += 1
+        t_submit = time.monotonic()
+        try:
+            position = self._pending - self.capacity
+            if position > 0 and on_wait is not None:
+                await on_wait(position)
+
+            async with self._slots:
+                self._in_progress += 1
+                t_start = time.monotonic()
+                try:
+                    return await self._run(func, *args)
+                finally:
+                    self._in_progress -= 1
+                    timing = JobTiming(wait=t_start - t_submit, run=time.monotonic() - t_start)
+                    self.timings.append(timing)
+                    self.total_jobs += 1
+                    self.logger.info(f'{func.__name__}: waited {timing.wait:.3f} sec, '
+                                     f'run {timing.run:.3f} sec, queue depth {self.queue_depth}')
+        finally:
+            self._pending -= 1
+
+    def stats(self):
+        def percentile(values, p):
+            if not values:
+                return 0.0
+            values = sorted(values)
+            return values[min(len(values) - 1, int(len(values) * p))]
+
+        waits = [t.wait for t in self.timings]
+        runs = [t.run for t in self.timings]
+        return {
+            'workers': self.workers,
+            'queue_depth': self.queue_depth,
+            'in_progress': self.in_progress,
+            'total_jobs': self.total_jobs,
+            'rejected_jobs': self.rejected_jobs,
+            'broken_pools': self.broken_pools,
+            'wait_p50': percentile(waits, 0.5),
+            'wait_p99': percentile(waits, 0.99),
+            'run_p50': percentile(runs, 0.5),
+            'run_p99': percentile(runs, 0.99),
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
@@ -0,0 +1,187 @@
+import json
+from collections import namedtuple
+from typing import List, Optional, Iterable
+
+from lib.datetime import now_ts, DAY, HOUR, parse_timespan_to_seconds
+from lib.db import DB
+
+TimeSeriesPoint = namedtuple('TimeSeriesPoint', ('timestamp', 'values'))
+
+
+def nearest_point(points: Iterable[TimeSeriesPoint], ts, tolerance=None) -> Optional[TimeSeriesPoint]:
+    """
+    The point closest to ts, or None if there are no points within the tolerance (seconds)
+    """
+    best = min(points, key=lambda p: abs(p.timestamp - ts), default=None)
+    if best is None or (tolerance is not None and abs(best.timestamp - ts) > tolerance):
+        return None
+    return best
+
+
+class TimeSeries:
+    """
+    Timestamped values in a Redis sorted set: score = timestamp, member = JSON [timestamp, {values}].
+    Downsampling: only the last point of every "resolution" seconds bucket is kept.
+    Retention: points older than "retention" seconds are trimmed on every write.
+    """
+
+    def __init__(self, db: DB, name, retention=DAY * 8, resolution=0):
+        self.db = db
+        self.name = name
+        self.retention = retention
+        self.resolution = resolution
+
+    @property
+    def key(self):
+        return f'ts:{self.name}'
+
+    @staticmethod
+    def _encode(ts, values: dict):
+        return json.dumps([ts, values], separators=(',', ':'))
+
+    @staticmethod
+    def _decode(member) -> TimeSeriesPoint:
+        ts, values = json.loads(member)
+        return TimeSeriesPoint(ts, values)
+
+    def _bucket(self, ts):
+        if not self.resolution:
+            return ts, ts
+        start = ts - ts % self.resolution
+        return start, start + self.resolution - 1e-6
+
+    async def add(self, values: dict, ts=None):
+        await self.add_many([TimeSeriesPoint(ts if ts is not None else now_ts(), values)])
+
+    async def add_many(self, points: Iterable[TimeSeriesPoint]):
+        points = sorted(points, key=lambda p: p.timestamp)
+        if not points:
+            return
+
+        r = await self.db.get_redis()
+        pipe = r.pipeline()
+        for ts, values in points:
+            ts = float(ts)
+            bucket_start, bucket_end = self._bucket(ts)
+            pipe.zremrangebyscore(self.key, min=bucket_start, max=bucket_end)
+            pipe.zadd(self.key, ts, self._encode(ts, values))
+        if self.retention:
+            newest = float(points[-1].timestamp)
+            pipe.zremrangebyscore(self.key, max=newest - self.retention, exclude=r.ZSET_EXCLUDE_MAX)
+        await pipe.execute()
+
+    async def range(self, t_from, t_to) -> List[TimeSeriesPoint]:
+        r = await self.db.get_redis()
+        members = await r.zrangebyscore(self.key, min=t_from, max=t_to)
+        return [self._decode(m) for m in members]
+
+    async def nearest(self, ts, tolerance) -> Optional[TimeSeriesPoint]:
+        return nearest_point(await self.range(ts - tolerance, ts + tolerance), ts, tolerance)
+
+    async def last(self) -> Optional[TimeSeriesPoint]:
+        r = await self.db.get_redis()
+        members = await r.zrevrange(self.key, 0, 0)
+        return self._decode(members[0]) if members else None
+
+    async def trim(self, before):
+        r = await self.db.get_redis()
+        return await r.zremrangebyscore(self.key, max=before, exclude=r.ZSET_EXCLUDE_MAX)
+
+    async def clear(self):
+        r = await self.db.get_redis()
+        await r.delete(self.key)
+
+
+class TieredTimeSeries:
+    """
+    A TimeSeries with tiered retention, e.g. raw points for 48h, hourly for 90 days and daily forever.
+    tiers = [(resolution, retention), ...] from the finest to the coarsest, retention 0 means forever.
+    New points go to the first tier; compact() downsamples every tier into the next one (the last point
+    of every bucket) and then trims the tiers by their retention. It is done by a background job.
+    Reads use the finest tier that still covers the start of the window and fill the not yet compacted end
+    from the finer tiers, every tier read is one ZRANGEBYSCORE: O(log n + k).
+    """
+
+    DEFAULT_TIERS = ((0, DAY * 2), (HOUR, DAY * 90), (DAY, 0))
+
+    def __init__(self, db: DB, name, tiers=DEFAULT_TIERS):
+        assert tiers, 'at least one tier is needed'
+        self.name = name
+        self.tiers = [
+            # the first tier keeps the plain name so the data recorded before is the raw tier now
+            TimeSeries(db, name if i == 0 else f'{name}:{resolution}', retention=0, resolution=resolution)
+            for i, (resolution, _) in enumerate(tiers)
+        ]
+        self.retentions = [retention for _, retention in tiers]
+
+    @classmethod
+    def from_config(cls, db: DB, name, cfg):
+        tiers = cfg.get('tiers')
+        if not tiers:
+            return cls(db, name)
+        return cls(db, name, [
+            (parse_timespan_to_seconds(str(t.get('resolution', 0))), parse_timespan_to_seconds(str(t.get('retention', 0))))
+            for t in tiers
+        ])
+
+    async def add(self, values: dict, ts=None):
+        await self.tiers[0].add(values, ts)
+
+    async def add_many(self, points: Iterable[TimeSeriesPoint]):
+        await self.tiers[0].add_many(points)
+
+    async def last(self) -> Optional[TimeSeriesPoint]:
+        for tier in self.tiers:
+            point = await tier.last()
+            if point is not None:
+                return point
+        return None
+
+    def _covers(self, index, t_from, newest):
+        retention = self.retentions[index]
+        return not retention or t_from >= newest - retention
+
+    async def range(self, t_from, t_to) -> List[TimeSeriesPoint]:
+        newest = await self.last()
+        if newest is None:
+            return []
+        first = next((i for i in range(len(self.tiers)) if self._covers(i, t_from, newest.timestamp)),
+                     len(self.tiers) - 1)
+
+        points = []
+        for tier in reversed(self.tiers[:first + 1]):
+            start = points[-1].timestamp if points else t_from
+            points += [p for p in await tier.range(start, t_to) if not points or p.timestamp > start]
+        return points
+
+    async def nearest(self, ts, tolerance) -> Optional[TimeSeriesPoint]:
+        return nearest_point(await self.range(ts - tolerance, ts + tolerance), ts, tolerance)
+
+    async def compact(self) -> int:
+        """
+        :return: number of points written to the coarser tiers
+        """
+        newest = await self.tiers[0].last()
+        if newest is None:
+            return 0
+
+        written = 0
+        for source, target in zip(self.tiers, self.tiers[1:]):
+            # the last bucket of the target might have been incomplete, so it is compacted again
+            last = await target.last()
+            start = target._bucket(last.timestamp)[0] if last else 0
+            buckets = {}
+            for point in await source.range(start, newest.timestamp):
+                buckets[target._bucket(point.timestamp)[0]] = point
+            await target.add_many(buckets.values())
+            written += len(buckets)
+
+        # only after compaction: every trimmed point has its bucket in the next tier already
+        for tier, retention in zip(self.tiers, self.retentions):
+            if retention:
+                await tier.trim(newest.timestamp - retention)
+        return written
+
+    async def clear(self):
+        for tier in self.tiers:
+            await tier.clear()
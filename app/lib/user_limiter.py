@@ -0,0 +1,42 @@
+from contextlib import asynccontextmanager
+
+
+class AlreadyInProgress(Exception):
+    pass
+
+
+class TooBusy(Exception):
+    pass
+
+
+class UserConcurrencyLimiter:
+    """
+    One job in flight per user and at most "max_concurrent" jobs in total.
+    Nobody waits here: a new request of a user who is still being served is rejected (AlreadyInProgress),
+    and so is any request above the global limit (TooBusy), so the user can be told at once.
+    The waiting line with positions is the render engine's bounded queue.
+    """
+
+    def __init__(self, max_concurrent=8):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self._active_users = set()
+
+    def is_busy(self, user_id):
+        return user_id in self._active_users
+
+    @property
+    def active_count(self):
+        return len(self._active_users)
+
+    @asynccontextmanager
+    async def acquire(self, user_id):
+        if user_id in self._active_users:
+            raise AlreadyInProgress(f'user {user_id} already has a job in progress')
+        if len(self._active_users) >= self.max_concurrent:
+            raise TooBusy(f'{len(self._active_users)} jobs in progress')
+
+        self._active_users.add(user_id)
+        try:
+            yield
+        finally:
+            self._active_users.discard(user_id)
@@ -1,9 +1,12 @@
+import html
 from abc import ABC
+from typing import List
 
-from lib.datetime import format_time_ago
+from lib.datetime import format_time_ago, seconds_human
 from lib.texts import code, link, pre, calc_percent_change, adaptive_round_to_str, emoji_for_percent_change, \
     pretty_dollar, pretty_money, bold
 from models.models import PriceReport
+from jobs.price_alerts import PriceAlert
 
 
 class BaseLocalization(ABC):  # == English
@@ -13,6 +16,7 @@ class BaseLocalization(ABC):  # == English
             f"Command list:\n"
             f"/help – this help page\n"
             f"/start – start/restart the bot\n"
+            f"/chart – price chart, /chart tvl 30d – TVL for 30 days, /chart rank – DeFi Pulse rank\n"
         )
 
     TEXT_WELCOME = ''
@@ -27,6 +31,13 @@ class BaseLocalization(ABC):  # == English
             "Use /help to see available commands."
         )
 
+    # ------- CHARTS -------
+
+    TEXT_CHART_NO_DATA = '📉 No data to draw yet. Please try again later.'
+
+    def text_chart_usage(self, metrics, windows):
+        return f"Usage: /chart [{' | '.join(metrics)}] [{' | '.join(windows)}]"
+
     # ------- AVATAR -------
 
     LOADING_STICKER = 'CAACAgIAAxkBAAIRx1--Tia-m6DNRIApk3yqmNWvap_sAALcAAP3AsgPUNi8Bnu98HweBA'
@@ -36,20 +47,48 @@ class BaseLocalization(ABC):  # == English
 
     TEXT_AVA_ERR_INVALID = '⚠️ Your picture has invalid format!'
     TEXT_AVA_ERR_SIZE = '🖼️ Your picture must be from 64x64 to 4096x4096'
+    TEXT_AVA_ERR_FILE_SIZE = '🖼️ Your file is too big. Please send a smaller one.'
+    TEXT_AVA_ERR_ANIMATION_FORMAT = '⚠️ I can only animate GIF files. Please send it as a file.'
     TEXT_AVA_ERR_NO_PIC = '⚠️ You have no user pic...'
+    TEXT_AVA_ERR_IN_PROGRESS = '⏳ Please wait, I am still working on your previous picture.'
+    TEXT_AVA_ERR_BUSY = '😓 Too many avatars are being made right now. Please try again in a minute.'
+    TEXT_AVA_ERR_RENDER = '⚠️ Sorry, I could not process this picture. Please try another one.'
     TEXT_AVA_READY = '🥳 <b>Your Alpha avatar is ready!</b> Download this image and set it as a profile picture' \
                      ' at Telegram and other social networks.'
 
     TEXT_AVA_READY_FROM_USERPIC = ''
 
+    TEXT_AVA_PREVIEW = '👀 A quick preview. The full-size avatar is on its way...'
+
+    def text_ava_in_line(self, position):
+        return f'⏳ I am busy right now, you are #{position} in line. Please wait...'
+
     BUTTON_AVA_FROM_MY_USERPIC = '😀 From my profile picture'
+    BUTTON_AVA_ALL_FRAMES = '🖼️ Try all frames'
 
     # ----------- PRICE NOTIFICATION ------------
 
     ALPHA_GECKO_URL = 'https://www.coingecko.com/en/coins/alpha-finance'
     ALPHA = 'ALPHA'
 
-    def notification_text_price_update(self, p: PriceReport):
+    def notification_text_price_alert(self, p: PriceReport, alert: PriceAlert):
+        direction = '📈 up' if alert.is_up else '📉 down'
+        c_gecko_link = link(self.ALPHA_GECKO_URL, self.ALPHA)
+        change = adaptive_round_to_str(alert.change, force_sign=True)
+        return (
+            f"{bold('Price alert')} | {c_gecko_link}\n\n"
+            f"<b>{self.ALPHA}</b> is {direction} {code(f'{change} %')} "
+            f"within {seconds_human(alert.rule.window)}: "
+            f"${alert.reference.price:.3f} → {code(f'${alert.price:.3f}')} "
+            f"{emoji_for_percent_change(alert.change)}"
+        )
+
+    @staticmethod
+    def _short_list(names: List[str], limit=3):
+        text = ', '.join(html.escape(name) for name in names[:limit])  # the names come from DeFi Pulse
+        return text + (f' and {len(names) - limit} more' if len(names) > limit else '')
+
+    def notification_text_price_update(self, p: PriceReport, watchlist: List[PriceReport] = ()):
         title = bold('Price update') if not p.is_ath else bold('🚀 A new all-time high has been achieved!')
 
         c_gecko_link = link(self.ALPHA_GECKO_URL, self.ALPHA)
@@ -92,10 +131,26 @@ class BaseLocalization(ABC):  # == English
             rank_delta_text = f'{arrow} {abs(p.defipulse.rank_delta)}'
 
         tlv_change_text = adaptive_round_to_str(p.defipulse.tlv_usd_relative_1d, force_sign=True)
+        if p.defipulse.tlv_usd_relative_7d is not None:
+            tlv_change_text += f" %, 7d: {adaptive_round_to_str(p.defipulse.tlv_usd_relative_7d, force_sign=True)}"
         message += (
             f"TVL of Alpha Homora v1 & v2: {code(pretty_dollar(p.defipulse.tlv_usd))}"
             f" ({tlv_change_text} %) {ath_tlv_text}\n"
             f"DeFi Pulse rank: #{bold(p.defipulse.rank)} {rank_delta_text}\n"
         )
+        if p.defipulse.overtook_us:
+            message += f"🙁 Overtook us: {self._short_list(p.defipulse.overtook_us)}\n"
+        if p.defipulse.we_overtook:
+            message += f"😃 We overtook: {self._short_list(p.defipulse.we_overtook)}\n"
+
+        if watchlist:
+            message += f"\n{bold('Watchlist')}\n"
+            for w in watchlist:
+                pc = w.price_and_cap.usd_24h_change
+                # CoinGecko has no 24h change (null) for thinly traded coins
+                change_text = f"{adaptive_round_to_str(pc, True).rjust(7)} % {emoji_for_percent_change(pc)}" \
+                    if pc is not None else '      ? %'
+                message += pre(f"{w.coin[:18].ljust(18)} {f'${w.price_and_cap.usd:.4g}'.ljust(10)} "
+                               f"{change_text}") + "\n"
 
         return message.rstrip()
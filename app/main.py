@@ -5,14 +5,25 @@ import aiohttp
 from aiogram import Bot, Dispatcher, executor
 from aiogram.types import *
 
+from jobs.charts import ChartKeeper
 from jobs.defipulse_job import DefiPulseFetcher, DefiPulseKeeper
+from jobs.history_job import HistoryCompactor
 from jobs.price_job import PriceFetcher, PriceHandler
+from jobs.scheduler import JobScheduler
+from jobs.stats_job import StatsReporter
 from lib.broadcast import Broadcaster
 from localization import LocalizationManager
 from dialog import init_dialogs
+from dialog.avatar_cache import AvatarResultCache
+from dialog.avatar_image_work import warm_up_overlays, parse_templates
 from lib.config import Config
+from lib.datetime import parse_timespan_to_seconds
 from lib.db import DB
 from lib.depcont import DepContainer
+from lib.disk_cache import DiskBlobCache
+from lib.http import HttpClient
+from lib.render_engine import RenderEngine
+from lib.user_limiter import UserConcurrencyLimiter
 
 
 class App:
@@ -41,6 +52,27 @@ class App:
         d.loc_man = LocalizationManager()
         d.broadcaster = Broadcaster(d)
 
+        frame_paths = [t.frame for t in parse_templates(d.cfg).values()]
+        warm_up_overlays(frame_paths)
+
+        render_cfg = d.cfg.get('avatar', {}).get('render', {})
+        d.render_engine = RenderEngine(workers=render_cfg.get('workers', 2),
+                                       max_queue=render_cfg.get('max_queue', 20),
+                                       initializer=warm_up_overlays, initargs=(frame_paths,))
+        d.render_engine.start()
+
+        cache_cfg = d.cfg.get('avatar', {}).get('cache', {})
+        disk_cache = DiskBlobCache(cache_cfg.get('dir', './cache/avatars'),
+                                   max_bytes=int(cache_cfg.get('max_size_mb', 200)) * 1024 * 1024)
+        d.avatar_cache = AvatarResultCache(d, disk_cache)
+
+        # by default as many as the render engine can take: running and queued
+        d.user_limiter = UserConcurrencyLimiter(
+            d.cfg.get('avatar', {}).get('max_concurrent_users',
+                                        d.render_engine.capacity + d.render_engine.max_queue))
+
+        d.charts = ChartKeeper(d)
+
         init_dialogs(d)
 
     async def connect_chat_storage(self):
@@ -52,25 +84,41 @@ class App:
         self.deps.defipulse = defipulse_saver = DefiPulseKeeper(self.deps)
         defipulse_fetcher.subscribe(defipulse_saver)
 
+        history_cfg = self.deps.cfg.data_source.defi_pulse.get('history', {})
+        history_compactor = HistoryCompactor(self.deps, [defipulse_saver.tvl_history],
+                                             parse_timespan_to_seconds(history_cfg.get('compaction_period', '1h')))
+        history_compactor.startup_sleep = 60.0
+
         price_fetcher = PriceFetcher(self.deps)
         price_fetcher.startup_sleep = 3.0
         price_handler = PriceHandler(self.deps)
         price_fetcher.subscribe(price_handler)
 
-        await asyncio.gather(*(task.run() for task in [
+        stats_reporter = StatsReporter(self.deps, parse_timespan_to_seconds(
+            str(self.deps.cfg.get('stats_log_period', '10m'))))
+
+        scheduler = self.deps.scheduler = JobScheduler.from_config(self.deps.cfg)
+        for fetcher in [
             defipulse_fetcher,   # fixme: not to spend credits
-            price_fetcher
-        ]))
+            price_fetcher,
+            history_compactor,
+            stats_reporter,
+        ]:
+            scheduler.add(fetcher)
+        await scheduler.run()
 
     async def on_startup(self, _=None):
         await self.connect_chat_storage()
 
         self.deps.session = aiohttp.ClientSession()
+        self.deps.http = HttpClient.from_config(self.deps.session, self.deps.cfg)
 
         asyncio.create_task(self._run_background_jobs())
 
     async def on_shutdown(self, _):
         await self.deps.session.close()
+        if self.deps.render_engine:
+            self.deps.render_engine.shutdown()
 
     def run_bot(self):
         self.create_bot_stuff()
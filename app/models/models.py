@@ -1,5 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
+from typing import Optional, List
 
 from dataclasses_json import dataclass_json
 
@@ -13,12 +14,15 @@ class DefiPulseEntry:
     name: str = 'no_name'
     tlv_usd: float = 0.0
     tlv_usd_relative_1d: float = 0.0
+    tlv_usd_relative_7d: Optional[float] = None
     tlv_is_ath: bool = False
 
     timestamp: int = 0
 
     rank: int = 0
     rank_delta: int = 0
+    overtook_us: List[str] = field(default_factory=list)
+    we_overtook: List[str] = field(default_factory=list)
 
     @classmethod
     def parse(cls, j):
@@ -74,3 +78,11 @@ class PriceReport:
     defipulse: DefiPulseEntry
     price_ath: PriceATH
     is_ath: bool = False
+    coin: str = ''  # CoinGecko id
+
+
+@dataclass_json
+@dataclass
+class RenderedAvatar:
+    file_id: str = ''  # Telegram file_id of the document we have already sent
+    digest: str = ''  # content address of the rendered bytes in the disk cache
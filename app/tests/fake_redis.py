@@ -0,0 +1,81 @@
+import math
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the few aioredis 1.3 commands the tests need
+    """
+    ZSET_EXCLUDE_MIN = 'ZSET_EXCLUDE_MIN'
+    ZSET_EXCLUDE_MAX = 'ZSET_EXCLUDE_MAX'
+    ZSET_EXCLUDE_BOTH = 'ZSET_EXCLUDE_BOTH'
+
+    def __init__(self):
+        self.data = {}
+
+    @staticmethod
+    def _encode(value):
+        return value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, expire=0):
+        self.data[key] = self._encode(value)
+
+    async def delete(self, key, *keys):
+        for k in (key, *keys):
+            self.data.pop(k, None)
+
+    def _zset(self, key):
+        return self.data.setdefault(key, {})
+
+    def _in_range(self, score, min, max, exclude):
+        lo_ok = score > min if exclude in (self.ZSET_EXCLUDE_MIN, self.ZSET_EXCLUDE_BOTH) else score >= min
+        hi_ok = score < max if exclude in (self.ZSET_EXCLUDE_MAX, self.ZSET_EXCLUDE_BOTH) else score <= max
+        return lo_ok and hi_ok
+
+    async def zadd(self, key, score, member):
+        self._zset(key)[self._encode(member)] = float(score)
+
+    async def zrangebyscore(self, key, min=-math.inf, max=math.inf, withscores=False, *, exclude=None):
+        items = sorted((s, m) for m, s in self._zset(key).items() if self._in_range(s, min, max, exclude))
+        return [(m, s) for s, m in items] if withscores else [m for s, m in items]
+
+    async def zremrangebyscore(self, key, min=-math.inf, max=math.inf, *, exclude=None):
+        zset = self._zset(key)
+        doomed = [m for m, s in zset.items() if self._in_range(s, min, max, exclude)]
+        for m in doomed:
+            del zset[m]
+        return len(doomed)
+
+    async def zrevrange(self, key, start, stop):
+        members = [m for s, m in sorted(((s, m) for m, s in self._zset(key).items()), reverse=True)]
+        return members[start:stop + 1 if stop >= 0 else None]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+
+        def call(*args, **kwargs):
+            self.calls.append((command, args, kwargs))
+
+        return call
+
+    async def execute(self):
+        return [await command(*args, **kwargs) for command, args, kwargs in self.calls]
+
+
+class FakeDB:
+    def __init__(self):
+        self.redis = FakeRedis()
+
+    async def get_redis(self):
+        return self.redis
@@ -0,0 +1,91 @@
+import asyncio
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from dialog.avatar_image_work import AdmissionLimits, CappedWriter, PhotoFileTooBig, PhotoSizeOutOfRange, \
+    InvalidPhoto, downloaded_photo
+
+
+class FakePhoto:
+    def __init__(self, data, file_size=None, chunk=1000):
+        self.data = data
+        self.file_size = file_size
+        self.chunk = chunk
+        self.bytes_sent = 0
+
+    async def download(self, destination, seek=True):
+        # the same sequence as aiogram's Bot.download_file: the chunks, then a rewind
+        for i in range(0, len(self.data), self.chunk):
+            destination.write(self.data[i:i + self.chunk])
+            self.bytes_sent += self.chunk
+        if seek:
+            destination.seek(0)
+
+
+def png_bytes(w, h):
+    bio = BytesIO()
+    Image.new('RGB', (w, h)).save(bio, 'PNG')
+    return bio.getvalue()
+
+
+def download(photo, limits):
+    async def go():
+        async with downloaded_photo(photo, spool_threshold=100, limits=limits) as source:
+            return source
+
+    return asyncio.get_event_loop().run_until_complete(go())
+
+
+def test_check_dimensions():
+    limits = AdmissionLimits(min_side=64, max_side=4096, max_pixels=1000 * 1000)
+    limits.check_dimensions(640, 480)
+    with pytest.raises(InvalidPhoto):
+        limits.check_dimensions(0, 0)
+    with pytest.raises(PhotoSizeOutOfRange):
+        limits.check_dimensions(32, 640)
+    with pytest.raises(PhotoSizeOutOfRange):
+        limits.check_dimensions(2000, 2000)
+
+
+def test_capped_writer():
+    target = BytesIO()
+    writer = CappedWriter(target, 10)
+    writer.write(b'12345')
+    writer.write(b'67890')
+    with pytest.raises(PhotoFileTooBig):
+        writer.write(b'!')
+    assert target.getvalue() == b'1234567890'
+
+
+def test_reported_file_size_rejected_before_download():
+    photo = FakePhoto(png_bytes(100, 100), file_size=10 ** 9)
+    with pytest.raises(PhotoFileTooBig):
+        download(photo, AdmissionLimits(max_file_size=10 ** 6))
+    assert photo.bytes_sent == 0
+
+
+def test_streamed_download_is_capped():
+    photo = FakePhoto(b'x' * 100_000, file_size=None)
+    with pytest.raises(PhotoFileTooBig):
+        download(photo, AdmissionLimits(max_file_size=10_000))
+    assert photo.bytes_sent <= 11_000
+
+
+def test_header_checked_before_decode():
+    with pytest.raises(PhotoSizeOutOfRange):
+        download(FakePhoto(png_bytes(5000, 100), file_size=1), AdmissionLimits())
+    with pytest.raises(InvalidPhoto):
+        download(FakePhoto(b'not an image' * 20), AdmissionLimits())
+    data = png_bytes(100, 100)
+    assert isinstance(download(FakePhoto(data), AdmissionLimits()), bytes)
+    assert isinstance(download(FakePhoto(data, file_size=len(data)), AdmissionLimits()), str)  # spooled to a file
+
+
+def test_capped_writer_rewinds_like_aiogram():
+    target = BytesIO()
+    writer = CappedWriter(target, 100)
+    writer.write(b'abc')
+    assert writer.seekable() and writer.seek(0) == 0 and writer.tell() == 0
+    assert target.getvalue() == b'abc'
@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+import pytest
+
+from lib.atomic_max import AtomicMax
+from lib.db import DB
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+@pytest.fixture
+def db():
+    # the script runs inside Redis, so a real one is needed (REDIS_HOST / REDIS_PORT)
+    db = DB(asyncio.get_event_loop())
+    if run(db.get_redis()) is None:
+        pytest.skip('no Redis available')
+    yield db
+    run(delete(db, 'test:atomic_max:plain', 'test:atomic_max:json'))
+    run(db.close_redis())
+
+
+async def delete(db, *keys):
+    # aioredis creates the reply future when the command is called: that needs a running loop
+    await db.redis.delete(*keys)
+
+
+def test_plain_number_max(db):
+    m = AtomicMax(db, 'test:atomic_max:plain')
+    run(delete(db, m.key))
+    assert run(m.update(10.0)) == (None, True)
+    assert run(m.update(5.0)) == (b'10.0', False)
+    assert run(m.update(12.5)) == (b'10.0', True)
+
+
+def test_json_field_max_with_floor(db):
+    m = AtomicMax(db, 'test:atomic_max:json', field='ath_price', floor=2.93)
+    run(delete(db, m.key))
+    assert run(m.update(2.5, json.dumps({'ath_price': 2.5}))) == (None, False)  # below the floor
+    assert run(m.update(3.0, json.dumps({'ath_price': 3.0}))) == (None, True)
+    old, updated = run(m.update(2.99, json.dumps({'ath_price': 2.99})))
+    assert json.loads(old) == {'ath_price': 3.0} and not updated
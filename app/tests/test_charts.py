@@ -0,0 +1,160 @@
+import asyncio
+from io import BytesIO
+
+from PIL import Image
+from aiogram.types import Message
+from aiogram.utils import exceptions
+from prodict import Prodict
+
+from jobs.charts import ChartKeeper
+from jobs.price_job import PriceHandler
+from lib.broadcast import Broadcaster
+from lib.charts import render_sparkline, bucketize, CHART_SIZE, CHART_UP, CHART_DOWN
+from lib.datetime import DAY, HOUR, MINUTE
+from lib.depcont import DepContainer
+from tests.fake_redis import FakeDB
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_bucketize():
+    points = [(t, float(t)) for t in range(0, 600, 60)]
+    assert bucketize(points, 300) == [(240, 240.0), (540, 540.0)]
+    assert bucketize(points, 0) == points
+
+
+def test_render_sparkline():
+    points = [(t * MINUTE, 1.0 + (t % 7) * 0.1) for t in range(100)]
+    for data in (render_sparkline(points, 'test'), render_sparkline(points[:1], 'empty')):
+        im = Image.open(BytesIO(data))
+        assert im.format == 'PNG' and im.size == CHART_SIZE
+
+
+def line_pixels(data, color):
+    im = Image.open(BytesIO(data)).convert('RGB')
+    return [(x, y) for x in range(im.width) for y in range(im.height) if im.getpixel((x, y)) == color]
+
+
+def test_rank_sparkline_is_inverted():
+    points = [(0, 12.0), (HOUR, 15.0)]  # from #12 down to #15
+
+    normal = line_pixels(render_sparkline(points, 'tvl'), CHART_UP)
+    assert normal and not line_pixels(render_sparkline(points, 'tvl'), CHART_DOWN)
+    assert min(normal)[1] > max(normal)[1]  # rises left to right
+
+    inverted = line_pixels(render_sparkline(points, 'rank', invert=True), CHART_DOWN)
+    assert inverted and not line_pixels(render_sparkline(points, 'rank', invert=True), CHART_UP)
+    assert min(inverted)[1] < max(inverted)[1]  # falls left to right
+
+
+class FakeSentPhoto:
+    def __init__(self, file_id):
+        self.photo = [Prodict(file_id=file_id)]
+
+
+def test_chart_is_rendered_and_uploaded_once():
+    d = DepContainer()
+    d.cfg = Prodict.from_dict({'data_source': {'coin_gecko': {'coins': ['alpha-finance']}}})
+    d.db = FakeDB()
+    charts = ChartKeeper(d)
+    series, _ = charts.series[ChartKeeper.METRIC_PRICE]
+
+    async def scenario():
+        assert await charts.get_chart() is None  # no data
+
+        t0 = 1_600_000_000
+        for i in range(50):
+            await series.add({'usd': 1.0 + i / 100}, t0 + i * HOUR)
+        results = await asyncio.gather(*(charts.get_chart('price', '7d') for _ in range(20)))
+        assert charts.renders == 1
+        assert all(r is results[0] for r in results)
+
+        uploads = []
+
+        async def send_photo(photo):
+            if not isinstance(photo, str):
+                uploads.append(photo)
+                await asyncio.sleep(0.01)
+            return FakeSentPhoto('file-1')
+
+        await asyncio.gather(*(ChartKeeper.send(results[0], send_photo) for _ in range(10)))
+        assert len(uploads) == 1 and results[0].file_id == 'file-1'
+
+        await series.add({'usd': 2.0}, t0 + 50 * HOUR)  # new point: new picture
+        chart = await charts.get_chart('price', '7d')
+        assert charts.renders == 2 and not chart.file_id
+
+    run(scenario())
+
+
+def make_chart_deps():
+    d = DepContainer()
+    d.cfg = Prodict.from_dict({
+        'data_source': {'coin_gecko': {'coins': ['alpha-finance'], 'fetch_period': 60}},
+        'notifications': {'price': {'period': '12h', 'ath': {'stickers': []}, 'chart': {'enabled': True}}},
+    })
+    d.db = FakeDB()
+    d.charts = ChartKeeper(d)
+    return d
+
+
+def test_price_chart_title_is_clamped_to_the_history(monkeypatch):
+    d = make_chart_deps()
+    series, _ = d.charts.series[ChartKeeper.METRIC_PRICE]
+    titles = []
+
+    def fake_render(points, title, value_format, invert=False):
+        titles.append(title)
+        return b'png'
+
+    async def scenario():
+        t0 = 1_600_000_000
+        for i in range(8 * 24 + 1):  # 8 days, as the price history keeps
+            await series.add({'usd': 1.0}, t0 + i * HOUR)
+        await d.charts.get_chart('price', '30d')
+        await d.charts.get_chart('price', '7d')
+
+    monkeypatch.setattr('jobs.charts.render_sparkline', fake_render)
+    run(scenario())
+    assert titles == ['ALPHA-FINANCE price, USD, 8d', 'ALPHA-FINANCE price, USD, 7d']
+
+
+class FlakyPhotoBot:
+    """
+    The first upload fails after reading the file, the rest succeed
+    """
+
+    def __init__(self):
+        self.uploads = []
+        self.by_file_id = 0
+
+    async def send_photo(self, chat_id, photo, *args, **kwargs):
+        if isinstance(photo, str):
+            self.by_file_id += 1
+        else:
+            self.uploads.append(photo.file.read())
+            if len(self.uploads) == 1:
+                raise exceptions.TelegramAPIError('upload failed')
+        return Message(message_id=len(self.uploads), photo=[{'file_id': 'file-1', 'file_unique_id': 'u1',
+                                                             'width': 800, 'height': 400}])
+
+
+def test_chart_broadcast_uploads_a_fresh_file_after_a_failure():
+    d = make_chart_deps()
+    d.bot = FlakyPhotoBot()
+    d.broadcaster = Broadcaster(d)
+    series, _ = d.charts.series[ChartKeeper.METRIC_PRICE]
+
+    async def scenario():
+        t0 = 1_600_000_000
+        for i in range(50):
+            await series.add({'usd': 1.0 + i / 100}, t0 + i * HOUR)
+        chart = await d.charts.get_chart('price', '7d')
+        await PriceHandler(d).send_chart(['@a', '@b', '@c', '@d'])
+        return chart
+
+    chart = run(scenario())
+    assert d.bot.uploads == [chart.data, chart.data]  # the second upload is whole, not an empty stream
+    assert d.bot.by_file_id == 2 and chart.file_id == 'file-1'
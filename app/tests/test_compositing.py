@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from dialog.avatar_image_work import combine_frame_and_photo_v2, COMPOSITING_NUMPY, COMPOSITING_PIL
+
+FRAME_PATH = 'app/data/alpha-avatar-v5.png'
+
+
+def make_photo(w, h, mode):
+    im = Image.linear_gradient('L').resize((w, h))
+    im = Image.merge('RGB', (im, im.transpose(Image.FLIP_LEFT_RIGHT), im.transpose(Image.FLIP_TOP_BOTTOM)))
+    return im.convert(mode)
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('w, h, size', [(160, 160, None), (480, 640, None), (1280, 960, 640), (100, 100, 320)])
+def test_numpy_compositing_is_pixel_equivalent(w, h, size, mode):
+    photo = make_photo(w, h, mode)
+    by_pil = combine_frame_and_photo_v2(photo.copy(), size, FRAME_PATH, COMPOSITING_PIL)
+    by_numpy = combine_frame_and_photo_v2(photo.copy(), size, FRAME_PATH, COMPOSITING_NUMPY)
+    assert by_numpy.mode == by_pil.mode
+    assert by_numpy.size == by_pil.size
+    assert np.array_equal(np.asarray(by_numpy), np.asarray(by_pil))
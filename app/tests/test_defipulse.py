@@ -1,9 +1,11 @@
+import asyncio
 import json
 import os
 
 import pytest
 
 from jobs.defipulse_job import DefiPulseFetcher, DefiPulseKeeper
+from lib.json_stream import iter_array_items
 
 
 @pytest.fixture
@@ -19,3 +21,35 @@ def test_parsedefi_pulse(defipulse_example_json):
     assert alpha_defi.name == DefiPulseFetcher.ALPHA_NAME
     assert alpha_defi.tlv_usd == 1023102498.0
     assert alpha_defi.tlv_usd_relative_1d == -7.57
+
+
+def test_parse_defipulse_stream():
+    with open('app/data/GetProjects_example_defipulse.json', 'rb') as f:
+        payload = f.read()
+    consumed = []
+
+    async def chunks(size=1000):
+        for i in range(0, len(payload), size):
+            consumed.append(i)
+            yield payload[i:i + size]
+
+    async def parse():
+        stream = DefiPulseFetcher.parse_defipulse_stream(chunks(), {DefiPulseFetcher.ALPHA_NAME})
+        return [e async for e in stream]
+
+    entries = asyncio.get_event_loop().run_until_complete(parse())
+    assert len(entries) == 1
+    alpha_defi = DefiPulseKeeper.find_alpha(entries)
+    assert alpha_defi.id == 49
+    assert alpha_defi.rank == 12
+    assert alpha_defi.tlv_usd == 1023102498.0
+    assert len(consumed) * 1000 < len(payload) / 2  # stopped reading early
+
+
+def test_json_array_scanner_chunk_boundaries():
+    text = '[{"a": {"name": "nested"}, "s": "}{\\"name\\": 1", "name": "real \\u00e9"}, {"b": [{"c": "}"}], "name": "two"}]'
+    for size in (1, 2, 3, 1000):
+        items = list(iter_array_items([text[i:i + size] for i in range(0, len(text), size)],
+                                      wanted=lambda name: name == 'two'))
+        assert [(pos, name) for pos, name, _ in items] == [(1, 'real é'), (2, 'two')]
+        assert items[0][2] is None and json.loads(items[1][2])['b'] == [{'c': '}'}]
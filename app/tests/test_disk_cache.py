@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+from dialog.avatar_cache import AvatarResultCache
+from lib.depcont import DepContainer
+from lib.disk_cache import DiskBlobCache
+from models.models import RenderedAvatar
+
+
+def test_disk_cache_content_addressed(tmp_path):
+    cache = DiskBlobCache(str(tmp_path), max_bytes=1000)
+    digest = cache.put(b'avatar')
+    assert digest == DiskBlobCache.digest(b'avatar')
+    assert cache.put(b'avatar') == digest
+    assert cache.total_bytes == 6
+    assert cache.get(digest) == b'avatar'
+    assert cache.get('0' * 64) is None
+
+
+def test_disk_cache_lru_eviction(tmp_path):
+    cache = DiskBlobCache(str(tmp_path), max_bytes=250)
+    a = cache.put(b'a' * 100)
+    b = cache.put(b'b' * 100)
+    assert cache.get(a)  # a is fresh now
+    c = cache.put(b'c' * 100)  # evicts b
+    assert cache.get(b) is None
+    assert cache.get(a) and cache.get(c)
+    assert cache.total_bytes == 200
+
+    reopened = DiskBlobCache(str(tmp_path), max_bytes=250)
+    assert reopened.total_bytes == 200
+    assert reopened.get(c) == b'c' * 100
+
+
+def test_avatar_result_cache_disk_tier_runs_in_executor(tmp_path):
+    cache = AvatarResultCache(DepContainer(), DiskBlobCache(str(tmp_path), max_bytes=1000))
+    main_thread = threading.get_ident()
+    threads = []
+    get = cache.disk.get
+
+    def tracked_get(digest):
+        threads.append(threading.get_ident())
+        return get(digest)
+
+    cache.disk.get = tracked_get
+
+    async def scenario():
+        record = RenderedAvatar(digest=await cache.store_bytes(b'avatar'))
+        return await cache.load_bytes(record), await cache.load_bytes(RenderedAvatar())
+
+    assert asyncio.get_event_loop().run_until_complete(scenario()) == (b'avatar', None)
+    assert threads and main_thread not in threads
@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import numpy as np
+from prodict import Prodict
+
+from jobs.defipulse_job import DefiPulseKeeper
+from lib.depcont import DepContainer
+from lib.leaderboard import LeaderboardSnapshot, diff_snapshots
+from models.models import DefiPulseEntry
+from tests.fake_redis import FakeDB
+
+
+def snapshot(ts, projects):
+    entries = [DefiPulseEntry(id=pid, name=f'p{pid}', tlv_usd=tvl, rank=rank)
+               for rank, (pid, tvl) in enumerate(projects, start=1)]
+    return LeaderboardSnapshot.from_entries(entries, ts)
+
+
+def test_snapshot_round_trip():
+    s = snapshot(100, [(7, 1e9), (3, 5e8), (42, 1.5)])
+    loaded = LeaderboardSnapshot.from_bytes(s.to_bytes())
+    assert loaded.timestamp == 100 and loaded.names == ['p7', 'p3', 'p42']
+    assert np.array_equal(loaded.ids, s.ids) and np.array_equal(loaded.ranks, [1, 2, 3])
+    assert np.array_equal(loaded.tvl, s.tvl)
+    assert len(LeaderboardSnapshot.from_bytes(snapshot(1, []).to_bytes())) == 0
+
+
+def test_diff_overtakes_and_movers():
+    prev = snapshot(0, [(1, 100.0), (2, 90.0), (3, 80.0), (4, 70.0), (5, 60.0)])
+    cur = snapshot(1, [(1, 100.0), (4, 95.0), (3, 85.0), (2, 70.0), (6, 65.0)])
+    diff = diff_snapshots(prev, cur)
+
+    assert diff.names == ['p1', 'p4', 'p3', 'p2']
+    assert list(diff.rank_delta) == [0, -2, 0, 2]
+    assert list(diff.new_ids) == [6] and list(diff.gone_ids) == [5]
+    assert diff.overtook(3) == ['p4']
+    assert diff.overtaken_by(3) == ['p2']
+    assert diff.overtook(2) == ['p4', 'p3'] and diff.overtaken_by(2) == []
+    assert diff.overtook(5) == []  # gone
+    assert diff.top_movers(2) == ['p4', 'p2']
+
+
+def test_keeper_tells_who_overtook_alpha():
+    d = DepContainer()
+    d.cfg = Prodict.from_dict({'data_source': {'defi_pulse': {}}})
+    d.db = FakeDB()
+    keeper = DefiPulseKeeper(d)
+
+    with open('app/data/GetProjects_example_defipulse.json', 'r') as f:
+        projects = json.load(f)
+
+    def entries(items):
+        result = [DefiPulseEntry.parse(item) for item in items]
+        for rank, e in enumerate(result, start=1):
+            e.rank = rank
+        return result
+
+    async def scenario():
+        first = entries(projects)
+        alpha = DefiPulseKeeper.find_alpha(first)
+        await keeper.update_leaderboard(alpha, first)
+        assert alpha.overtook_us == [] and alpha.we_overtook == []
+
+        i = next(i for i, p in enumerate(projects) if p['name'] == alpha.name)
+        swapped = projects[:i - 1] + [projects[i], projects[i - 1]] + projects[i + 1:]
+        second = entries(swapped)
+        alpha = DefiPulseKeeper.find_alpha(second)
+        await keeper.update_leaderboard(alpha, second)
+        assert alpha.we_overtook == [projects[i - 1]['name']] and alpha.overtook_us == []
+
+    asyncio.get_event_loop().run_until_complete(scenario())
@@ -0,0 +1,96 @@
+import asyncio
+from io import BytesIO
+
+import pytest
+from PIL import Image
+from aiogram.types import PhotoSize
+
+from dialog.avatar_image_work import OutputFormat, OUTPUT_FORMATS, FrameTemplate, render_avatar, render_avatars, \
+    render_preview, smallest_photo_size, PREVIEW_SIZE
+
+
+@pytest.mark.parametrize('fmt', OUTPUT_FORMATS)
+def test_encode_all_formats(fmt):
+    output = OutputFormat.from_config({'format': fmt})
+    encoded = output.encode(Image.new('RGBA', (64, 64), (10, 20, 30, 255)))
+    assert encoded.encode_time >= 0
+    decoded = Image.open(BytesIO(encoded.data))
+    assert decoded.size == (64, 64)
+    assert decoded.format.lower() == output.extension.replace('jpg', 'jpeg')
+
+
+def test_bad_output_format():
+    with pytest.raises(ValueError):
+        OutputFormat.from_config({'format': 'bmp'})
+
+
+def test_render_avatar_at_target_size():
+    bio = BytesIO()
+    Image.new('RGB', (800, 600), 'blue').save(bio, 'JPEG')
+    template = FrameTemplate('v5', 'app/data/alpha-avatar-v5.png', OutputFormat('jpeg'))
+    result = render_avatar(bio.getvalue(), template, 320)
+    assert Image.open(BytesIO(result.data)).size == (320, 320)
+
+
+def test_render_preview_is_small_jpeg():
+    bio = BytesIO()
+    Image.new('RGB', (90, 67), 'blue').save(bio, 'JPEG')  # Telegram's smallest PhotoSize
+    template = FrameTemplate('v5', 'app/data/alpha-avatar-v5.png', OutputFormat('png'))
+    result = asyncio.get_event_loop().run_until_complete(render_preview(bio.getvalue(), template))
+    preview = Image.open(BytesIO(result.data))
+    assert preview.format == 'JPEG'
+    assert preview.size == (PREVIEW_SIZE, PREVIEW_SIZE)
+
+
+def test_smallest_photo_size():
+    sizes = [PhotoSize(width=w, height=h) for w, h in ((320, 240), (90, 67), (800, 600))]
+    assert smallest_photo_size(sizes).width == 90
+    assert smallest_photo_size([]) is None
+
+
+def test_render_avatar_from_spooled_file(tmp_path):
+    path = str(tmp_path / 'big.jpg')
+    Image.new('RGB', (4096, 3072), 'green').save(path, 'JPEG')
+
+    im = Image.open(path)
+    im.draft('RGB', (640, 640))
+    assert im.size == (1024, 768)  # decoded at 1/4 scale
+
+    template = FrameTemplate('v5', 'app/data/alpha-avatar-v5.png', OutputFormat('png', compress_level=1))
+    result = render_avatar(path, template, 640)
+    assert Image.open(BytesIO(result.data)).size == (640, 640)
+
+
+def test_render_all_templates_from_one_decode():
+    bio = BytesIO()
+    Image.new('RGB', (640, 640), 'white').save(bio, 'PNG')
+    templates = [FrameTemplate(f'v{i}', f'app/data/alpha-avatar-v{i}.png') for i in (2, 3, 4, 5)]
+    results = render_avatars(bio.getvalue(), templates, 320)
+    assert len(results) == 4
+    pics = [Image.open(BytesIO(r.data)).convert('RGB') for r in results]
+    assert all(p.size == (320, 320) for p in pics)
+    assert len({p.tobytes() for p in pics}) == 4  # every frame is drawn on its own copy
+
+
+def test_render_animated_avatar_is_capped():
+    from PIL import ImageSequence
+    from dialog.avatar_image_work import render_animated_avatar, AnimationLimits, PhotoSizeOutOfRange
+
+    frames = [Image.new('RGB', (200, 150), (i * 20, 100, 255 - i * 20)) for i in range(10)]
+    bio = BytesIO()
+    frames[0].save(bio, 'GIF', save_all=True, append_images=frames[1:], duration=80, loop=0)
+
+    template = FrameTemplate('v5', 'app/data/alpha-avatar-v5.png')
+    result = render_animated_avatar(bio.getvalue(), template, AnimationLimits(size=128, max_frames=6))
+    gif = Image.open(BytesIO(result.data))
+    assert gif.size == (128, 128)
+    assert gif.n_frames == 6
+    colors = {f.convert('RGB').getpixel((64, 64)) for f in ImageSequence.Iterator(gif)}
+    assert len(colors) > 1  # every frame has its own palette
+
+    result = render_animated_avatar(bio.getvalue(), template, AnimationLimits(size=128, max_pixels=200 * 150 * 3))
+    assert Image.open(BytesIO(result.data)).n_frames == 3
+
+    for limits in (AnimationLimits(size=128, max_frames=0), AnimationLimits(size=128, max_pixels=200 * 150 - 1)):
+        with pytest.raises(PhotoSizeOutOfRange):  # not even the first frame: no broken GIF
+            render_animated_avatar(bio.getvalue(), template, limits)
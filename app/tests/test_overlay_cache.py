@@ -0,0 +1,34 @@
+from dialog.avatar_image_work import OverlayCache
+
+FRAME_PATH = 'app/data/alpha-avatar-v5.png'
+LOGO_PATH = 'app/data/alpha-logo.png'
+
+
+def test_overlay_cache_reuses_variants():
+    cache = OverlayCache(max_variants=4)
+    a = cache.get(FRAME_PATH, (320, 320))
+    b = cache.get(FRAME_PATH, (320, 320))
+    assert a is b
+    assert a.size == (320, 320)
+    assert a.mode == 'RGBA'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_overlay_cache_decodes_source_once():
+    cache = OverlayCache()
+    cache.preload([FRAME_PATH, LOGO_PATH], sizes=(160, 640))
+    src = cache.source(FRAME_PATH)
+    cache.get(FRAME_PATH, (1280, 1280))
+    assert cache.source(FRAME_PATH) is src
+
+
+def test_overlay_cache_lru_eviction():
+    cache = OverlayCache(max_variants=2)
+    first = cache.get(FRAME_PATH, (160, 160))
+    cache.get(FRAME_PATH, (320, 320))
+    cache.get(FRAME_PATH, (160, 160))  # touch
+    cache.get(FRAME_PATH, (640, 640))  # evicts 320
+    assert cache.get(FRAME_PATH, (160, 160)) is first
+    misses = cache.misses
+    cache.get(FRAME_PATH, (320, 320))
+    assert cache.misses == misses + 1
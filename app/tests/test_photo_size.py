@@ -0,0 +1,20 @@
+from aiogram.types import PhotoSize
+
+from dialog.avatar_image_work import choose_photo_size
+
+
+def sizes(*dims):
+    return [PhotoSize(file_id=f'{w}x{h}', width=w, height=h) for w, h in dims]
+
+
+def test_choose_smallest_covering_size():
+    photos = sizes((90, 67), (320, 240), (800, 600), (1280, 960))
+    assert choose_photo_size(photos, 640).file_id == '1280x960'
+    assert choose_photo_size(photos, 600).file_id == '800x600'
+    assert choose_photo_size(photos, 100).file_id == '320x240'
+
+
+def test_choose_biggest_if_nothing_covers():
+    photos = sizes((160, 160), (640, 640), (320, 320))
+    assert choose_photo_size(photos, 1024).file_id == '640x640'
+    assert choose_photo_size([], 640) is None
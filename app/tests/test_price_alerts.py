@@ -0,0 +1,63 @@
+import asyncio
+
+from jobs.price_alerts import RollingWindow, PriceAlertEngine, PriceAlertRule
+from lib.datetime import MINUTE, HOUR
+from localization import BaseLocalization
+from tests.fake_redis import FakeDB
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class FakeDeps:
+    def __init__(self):
+        self.db = FakeDB()
+
+
+def test_rolling_window_min_max():
+    w = RollingWindow(window=5 * MINUTE, capacity=7)
+    prices = [1.0, 3.0, 2.0, 0.5, 4.0, 2.5, 2.6, 2.7, 2.8, 2.9]
+    for i, price in enumerate(prices):
+        w.add(i * MINUTE, price)
+        expected = prices[max(0, i - 5):i + 1]
+        assert w.low.price == min(expected)
+        assert w.high.price == max(expected)
+    assert len(w) == 6
+
+
+def test_ring_buffer_is_bounded():
+    w = RollingWindow(window=HOUR, capacity=3)
+    for i, price in enumerate([9.0, 1.0, 2.0, 3.0]):
+        w.add(i, price)
+    assert len(w) == 3
+    assert w.high.price == 3.0  # 9.0 has been pushed out
+
+
+def test_alert_rules():
+    fast = PriceAlertRule(window=15 * MINUTE, threshold=5.0, cooldown=HOUR)
+    engine = PriceAlertEngine(FakeDeps(), [fast], sample_period=MINUTE)
+
+    t = 1_600_000_000
+    for i in range(30):  # +0.1% a minute: slow drift, no alert
+        assert not engine.update(t + i * MINUTE, 1.0 + i * 0.001)
+
+    alerts = engine.update(t + 30 * MINUTE, 1.09)
+    assert len(alerts) == 1 and alerts[0].is_up
+    assert round(alerts[0].reference.price, 3) == 1.015
+
+    alerts = engine.update(t + 31 * MINUTE, 1.0)
+    assert len(alerts) == 1 and not alerts[0].is_up
+
+
+def test_alert_cooldown():
+    rule = PriceAlertRule(window=15 * MINUTE, threshold=5.0, cooldown=HOUR)
+    engine = PriceAlertEngine(FakeDeps(), [rule], sample_period=MINUTE)
+    t = 1_600_000_000
+    run(engine.check(t, 1.0))
+    first = run(engine.check(t + MINUTE, 1.2))
+    second = run(engine.check(t + 2 * MINUTE, 1.3))
+    assert len(first) == 1 and not second
+
+    text = BaseLocalization().notification_text_price_alert(None, first[0])
+    assert '+20' in text and '15 min' in text
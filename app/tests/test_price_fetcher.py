@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+from prodict import Prodict
+
+from jobs.price_job import PriceFetcher
+from lib.depcont import DepContainer
+from localization import BaseLocalization
+from models.models import PriceReport, CoinPriceInfo, PriceHistoricalTriplet, DefiPulseEntry, PriceATH
+from tests.fake_redis import FakeDB
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class FakeGecko:
+    def __init__(self):
+        self.urls = []
+
+    async def get_json(self, url, ttl=None):
+        self.urls.append(url)
+        ids = url.split('ids=')[1].split('&')[0].split('%2C') if 'ids=' in url else []
+        if '/simple/price' in url:
+            return {coin: {'usd': 1.0 + i, 'btc': 0.0001} for i, coin in enumerate(ids)}
+        elif '/coins/markets' in url:
+            return [{'id': coin, 'market_cap_rank': 100 + i} for i, coin in enumerate(ids)]
+        elif '/market_chart/range' in url:
+            t_from = int(url.split('from=')[1].split('&')[0])
+            return {'prices': [[(t_from + 60) * 1000, 0.5]]}
+
+
+@pytest.fixture
+def price_fetcher():
+    d = DepContainer()
+    d.cfg = Prodict.from_dict({
+        'data_source': {'coin_gecko': {
+            'fetch_period': 60,
+            'refresh': {'rank': '1h', 'price_7d': 0},
+            'coins': ['alpha-finance', 'sushi', 'cream-2'],
+        }}
+    })
+    d.db = FakeDB()
+    d.http = FakeGecko()
+    return PriceFetcher(d)
+
+
+def test_refresh_periods(price_fetcher):
+    assert price_fetcher.refresh_periods['rank'] == 3600
+    assert price_fetcher.refresh_periods['price_24h'] == 300  # default
+    assert price_fetcher.refresh_periods['price_7d'] == 0
+
+
+def test_refreshed_resource_is_reused(price_fetcher):
+    calls = []
+
+    async def fetch_rank():
+        calls.append(1)
+        return len(calls)
+
+    assert run(price_fetcher._refreshed('rank', fetch_rank)) == 1
+    assert run(price_fetcher._refreshed('rank', fetch_rank)) == 1
+    assert run(price_fetcher._refreshed('price_7d', fetch_rank)) == 2
+    assert run(price_fetcher._refreshed('price_7d', fetch_rank)) == 3  # period 0: every time
+
+
+def test_refresh_failure_keeps_old_value(price_fetcher):
+    async def good():
+        return 42
+
+    async def bad():
+        raise ConnectionError('down')
+
+    price_fetcher.refresh_periods['price_7d'] = 0
+    with pytest.raises(ConnectionError):
+        run(price_fetcher._refreshed('price_7d', bad))
+    assert run(price_fetcher._refreshed('price_7d', good)) == 42
+    assert run(price_fetcher._refreshed('price_7d', bad)) == 42
+
+
+def test_chunk_coins():
+    coins = [f'coin-number-{i}' for i in range(500)]
+    chunks = PriceFetcher.chunk_coins(PriceFetcher.COIN_PRICE_GECKO, coins)
+    assert sum(chunks, []) == coins
+    for chunk in chunks:
+        assert len(PriceFetcher.COIN_PRICE_GECKO.format(coins='%2C'.join(chunk))) <= PriceFetcher.MAX_URL_LENGTH
+    assert PriceFetcher.chunk_coins(PriceFetcher.COIN_PRICE_GECKO, ['a', 'b']) == [['a', 'b']]
+
+
+def test_fetch_all_coins_in_batches(price_fetcher):
+    reports = run(price_fetcher.fetch())
+    assert [r.coin for r in reports] == ['alpha-finance', 'sushi', 'cream-2']
+    assert [r.price_and_cap.rank for r in reports] == [100, 101, 102]
+    assert reports[1].price_and_cap.usd == 2.0
+    assert reports[0].price_change.price_24h == 0.5  # backfilled
+    assert reports[2].price_change == PriceHistoricalTriplet()  # the watchlist does not need it
+
+    urls = price_fetcher.deps.http.urls
+    assert all('alpha-finance' in u for u in urls if '/market_chart/range' in u)
+    assert sum('/simple/price' in u for u in urls) == 1
+    assert sum('/coins/markets' in u for u in urls) == 1
+
+    price_fetcher.deps.http.urls.clear()
+    run(price_fetcher.fetch())
+    assert sum('/coins/markets' in u for u in urls) == 0  # the rank is still fresh
+
+
+def test_watchlist_in_notification():
+    def report(coin, usd, change=-3.2):
+        return PriceReport(CoinPriceInfo(usd=usd, usd_24h_change=change), PriceHistoricalTriplet(),
+                           DefiPulseEntry(), PriceATH(), coin=coin)
+
+    text = BaseLocalization().notification_text_price_update(report('alpha-finance', 1.5),
+                                                             [report('sushi', 12.3), report('cream-2', 0.000123, change=None)])
+    assert 'Watchlist' in text
+    assert 'sushi' in text and '$12.3' in text
+    assert '$0.000123' in text and '? %' in text
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from lib.render_engine import RenderEngine, RenderQueueFull
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def square(x):
+    return x * x
+
+
+def slow_square(x):
+    time.sleep(0.05)
+    return x * x
+
+
+def die_if_first(marker_path):
+    # the first call kills its worker the way the OOM killer does, the retry succeeds
+    if not os.path.exists(marker_path):
+        open(marker_path, 'w').close()
+        os._exit(1)
+    return 'ok'
+
+
+def always_die():
+    os._exit(1)
+
+
+def test_queue_positions_rejection_and_timings():
+    engine = RenderEngine(workers=0, max_queue=2)  # threads: capacity 1
+    positions = []
+
+    async def on_wait(position):
+        positions.append(position)
+
+    async def scenario():
+        jobs = [asyncio.ensure_future(engine.submit(slow_square, i, on_wait=on_wait)) for i in range(3)]
+        await asyncio.sleep(0)
+        with pytest.raises(RenderQueueFull):
+            await engine.submit(slow_square, 10)
+        assert engine.queue_depth == 2
+        return await asyncio.gather(*jobs)
+
+    assert run(scenario()) == [0, 1, 4]
+    assert positions == [1, 2]
+    stats = engine.stats()
+    assert stats['total_jobs'] == 3 and stats['rejected_jobs'] == 1 and stats['queue_depth'] == 0
+    assert stats['run_p50'] >= 0.04 and stats['wait_p99'] >= 0.08
+
+
+def test_broken_pool_is_replaced(tmp_path):
+    engine = RenderEngine(workers=1, max_queue=2)
+    engine.start()
+    try:
+        assert run(engine.submit(die_if_first, str(tmp_path / 'marker'))) == 'ok'
+        assert engine.broken_pools == 1
+        assert run(engine.submit(square, 3)) == 9
+
+        with pytest.raises(BrokenProcessPool):
+            run(engine.submit(always_die))
+        assert run(engine.submit(square, 4)) == 16  # still alive for everyone else
+    finally:
+        engine.shutdown()
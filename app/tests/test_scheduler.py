@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from jobs.base import BaseFetcher, INotified
+from jobs.scheduler import JobScheduler
+from lib.depcont import DepContainer
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class TickFetcher(BaseFetcher):
+    def __init__(self, fail=False):
+        super().__init__(DepContainer(), sleep_period=0.05)
+        self.fail = fail
+        self.started = []
+
+    async def fetch(self):
+        self.started.append(time.monotonic())
+        if self.fail:
+            raise ValueError('boom')
+        return 'data'
+
+
+class SlowDelegate(INotified):
+    def __init__(self, work_time):
+        self.work_time = work_time
+
+    async def on_data(self, sender, data):
+        await asyncio.sleep(self.work_time)
+
+
+def run_for(scheduler, seconds):
+    async def scenario():
+        task = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(seconds)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    run(scenario())
+
+
+def test_fixed_rate_does_not_drift():
+    fetcher = TickFetcher().subscribe(SlowDelegate(0.03))
+    scheduler = JobScheduler()
+    job = scheduler.add(fetcher, startup_delay=0.0)
+    run_for(scheduler, 0.52)
+
+    # a sleep after every run would give 0.5 / (0.05 + 0.03) ~ 6 runs
+    assert 10 <= len(fetcher.started) <= 11
+    starts = fetcher.started
+    assert abs((starts[-1] - starts[0]) - (len(starts) - 1) * 0.05) < 0.02
+    assert job.stats.skipped == 0 and job.stats.runs >= 10
+    assert 0.03 <= job.stats.summary()['duration']['p50'] < 0.05
+
+
+def test_overrunning_ticks_are_skipped_and_errors_counted():
+    slow = TickFetcher().subscribe(SlowDelegate(0.12))
+    broken = TickFetcher(fail=True)
+    scheduler = JobScheduler(jitter=0.01, seed=1)
+    slow_job = scheduler.add(slow, startup_delay=0.0)
+    broken_job = scheduler.add(broken, startup_delay=0.0)
+    run_for(scheduler, 0.5)
+
+    assert 3 <= len(slow.started) <= 4  # every third tick starts a run, the other two are skipped
+    assert slow_job.stats.skipped >= 6
+    assert broken_job.stats.errors == broken_job.stats.runs >= 8
+    assert scheduler.report()['TickFetcher']['runs'] > 0
+    assert all(0.0 <= late < 0.05 for late in broken_job.stats.lateness)
+
+
+def test_wall_clock_anchor():
+    scheduler = JobScheduler(anchor=JobScheduler.ANCHOR_WALL)
+    job = scheduler.add(TickFetcher(), period=0.1, startup_delay=0.0)
+    first = scheduler._first_tick(job)
+    assert first >= time.time() - 0.01 and abs(first / 0.1 - round(first / 0.1)) < 1e-6
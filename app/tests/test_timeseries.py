@@ -0,0 +1,68 @@
+import asyncio
+
+from lib.datetime import MINUTE, HOUR, DAY
+from lib.timeseries import TimeSeries, TimeSeriesPoint, nearest_point, TieredTimeSeries
+from tests.fake_redis import FakeDB
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_nearest_point():
+    points = [TimeSeriesPoint(t, {'usd': t}) for t in (100, 200, 300)]
+    assert nearest_point(points, 240).timestamp == 200
+    assert nearest_point(points, 260).timestamp == 300
+    assert nearest_point(points, 1000, tolerance=100) is None
+    assert nearest_point([], 100) is None
+
+
+def test_downsampling_keeps_last_point_of_bucket():
+    ts = TimeSeries(FakeDB(), 'test', retention=0, resolution=5 * MINUTE)
+    t0 = 1_600_000_200  # 5 min bucket boundary
+    run(ts.add_many([TimeSeriesPoint(t0 + i * MINUTE, {'usd': i}) for i in range(10)]))
+    points = run(ts.range(0, t0 + DAY))
+    assert [p.values['usd'] for p in points] == [4, 9]
+
+
+def test_retention_and_nearest_lookup():
+    ts = TimeSeries(FakeDB(), 'test', retention=DAY, resolution=0)
+    t0 = 1_600_000_000
+    for i in range(30):
+        run(ts.add({'usd': float(i)}, t0 + i * HOUR))
+
+    now = t0 + 29 * HOUR
+    points = run(ts.range(0, now))
+    assert len(points) == 25  # older than a day are trimmed
+    assert run(ts.nearest(now - HOUR - 2 * MINUTE, tolerance=5 * MINUTE)).values['usd'] == 28.0
+    assert run(ts.nearest(now - 2 * DAY, tolerance=HOUR)) is None  # a gap
+    assert run(ts.last()).values['usd'] == 29.0
+
+
+def test_tiered_compaction_and_reads():
+    db = FakeDB()
+    history = TieredTimeSeries(db, 'test', [(0, 2 * DAY), (HOUR, 10 * DAY), (DAY, 0)])
+    t0 = 1_600_041_600  # day boundary
+    for day in range(20):
+        run(history.add_many([TimeSeriesPoint(t0 + day * DAY + i * 10 * MINUTE, {'usd': float(day * 1000 + i)})
+                              for i in range(144)]))
+        assert run(history.compact()) > 0
+    run(history.compact())  # nothing new: the same buckets are rewritten
+
+    raw, hourly, daily = history.tiers
+    now = run(history.last()).timestamp
+    assert now == t0 + 19 * DAY + 143 * 10 * MINUTE
+    assert len(run(raw.range(0, now))) == 2 * 144 + 1
+    assert len(run(hourly.range(0, now))) == 10 * 24 + 1
+    assert [p.values['usd'] for p in run(daily.range(0, now))] == [day * 1000.0 + 143 for day in range(20)]
+
+    # fresh window: raw points; older: hourly, then daily, stitched with the not yet compacted ones
+    assert len(run(history.range(now - DAY, now))) == 145
+    week = run(history.range(now - 7 * DAY, now))
+    assert len(week) == 7 * 24 + 1 and week[-1].timestamp == now
+    all_time = run(history.range(0, now))
+    assert all_time[0].values['usd'] == 143.0 and all_time[-1].timestamp == now
+    assert run(history.nearest(t0 + 3 * DAY, DAY)).values['usd'] == 2143.0
+
+    run(history.add({'usd': -1.0}, now + 5 * MINUTE))  # a fresh point is read before the compaction
+    assert run(history.range(now - 7 * DAY, now + HOUR))[-1].values['usd'] == -1.0
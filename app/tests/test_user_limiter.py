@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from lib.user_limiter import UserConcurrencyLimiter, AlreadyInProgress, TooBusy
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_one_job_per_user():
+    limiter = UserConcurrencyLimiter(max_concurrent=8)
+
+    async def scenario():
+        async with limiter.acquire(1):
+            assert limiter.is_busy(1)
+            with pytest.raises(AlreadyInProgress):
+                async with limiter.acquire(1):
+                    pass
+            async with limiter.acquire(2):
+                assert limiter.active_count == 2
+        assert not limiter.is_busy(1) and limiter.active_count == 0
+
+    run(scenario())
+
+
+def test_global_cap_rejects_at_once():
+    limiter = UserConcurrencyLimiter(max_concurrent=2)
+    release = asyncio.Event()
+
+    async def job(user_id):
+        async with limiter.acquire(user_id):
+            await release.wait()
+
+    async def scenario():
+        jobs = [asyncio.ensure_future(job(user_id)) for user_id in (1, 2)]
+        await asyncio.sleep(0)
+        with pytest.raises(TooBusy):
+            async with limiter.acquire(3):
+                pass
+        assert not limiter.is_busy(3)  # a rejected user can try again later
+
+        release.set()
+        await asyncio.gather(*jobs)
+        async with limiter.acquire(3):
+            assert limiter.active_count == 1
+
+    run(scenario())
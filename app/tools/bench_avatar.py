@@ -0,0 +1,148 @@
+"""
+Offline benchmark of the avatar image path.
+Run it from the "app" dir (frame assets are loaded from ./data):
+
+    python tools/bench_avatar.py --out bench_avatar.json
+
+Compare two runs by diffing their JSON files.
+Every case runs in a fresh worker process, so its peak RSS is its own and not the biggest case so far.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL
+from PIL import Image
+from prodict import Prodict
+
+from dialog.avatar_image_work import image_square_crop, combine_frame_and_photo, combine_frame_and_photo_v2, \
+    img_to_bio, OutputFormat, OUTPUT_FORMATS, warm_up_overlays, COMPOSITING_BACKENDS
+
+SIZES = (64, 160, 320, 640, 1280, 2048, 4096)
+ASPECTS = {
+    '1:1': (1, 1),
+    '4:3': (4, 3),
+    '3:4': (3, 4),
+    '16:9': (16, 9),
+}
+MODES = ('RGB', 'RGBA', 'P', 'L')
+
+V1_CONFIG = Prodict(avatar={'position': {'x': 50, 'y': 85}, 'scale': 30})
+
+
+def make_photo(side, aspect, mode):
+    aw, ah = ASPECTS[aspect]
+    w, h = (side, side * ah // aw) if aw >= ah else (side * aw // ah, side)
+    im = Image.linear_gradient('L').resize((w, h))
+    im = Image.merge('RGB', (im, im.transpose(Image.FLIP_LEFT_RIGHT), im.transpose(Image.FLIP_TOP_BOTTOM)))
+    if mode == 'P':
+        return im.quantize(64)
+    return im.convert(mode)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KB on Linux
+
+
+def measure(func, photo, repeat):
+    rss_before = peak_rss_mb()
+    latencies = []
+    for _ in range(repeat):
+        arg = photo.copy()  # the combiners paste into the photo, so give each run a fresh one
+        t0 = time.perf_counter()
+        func(arg)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'runs': repeat,
+        'renders_per_sec': repeat / total if total else 0.0,
+        'p50_ms': latencies[len(latencies) // 2] * 1000.0,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - rss_before,
+    }
+
+
+def measure_case(name, target_size, side, aspect, mode, repeat):
+    """
+    Runs in a worker process that is used for this case only
+    """
+    func = dict(benchmarks(target_size))[name]
+    photo = make_photo(side, aspect, mode)
+    stats = measure(func, photo, repeat)
+    stats.update(bench=name, size=side, aspect=aspect, mode=mode, input_size=list(photo.size))
+    return stats
+
+
+def benchmarks(target_size):
+    v1 = combine_frame_and_photo.__wrapped__  # skip the executor, measure the pure function
+
+    yield 'image_square_crop', image_square_crop
+    yield 'combine_frame_and_photo', lambda im: v1(V1_CONFIG, im)
+    for backend in COMPOSITING_BACKENDS:
+        yield f'combine_frame_and_photo_v2[{backend}]', \
+            lambda im, b=backend: combine_frame_and_photo_v2(im, compositing=b)
+        yield f'combine_frame_and_photo_v2[{backend}]@{target_size}', \
+            lambda im, b=backend: combine_frame_and_photo_v2(im, target_size, compositing=b)
+    for fmt in OUTPUT_FORMATS:
+        output = OutputFormat(fmt)
+        yield f'img_to_bio[{fmt}]', lambda im, o=output: img_to_bio(image_square_crop(im), 'bench', o)
+
+
+def repeat_for(side, base_repeat):
+    # keep the huge cases affordable
+    return max(3, int(base_repeat * min(1.0, (640.0 / side) ** 2)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Avatar pipeline benchmark')
+    parser.add_argument('--out', default='bench_avatar.json', help='JSON report path')
+    parser.add_argument('--repeat', type=int, default=30, help='runs per case at 640px (fewer for bigger inputs)')
+    parser.add_argument('--target-size', type=int, default=640)
+    parser.add_argument('--sizes', type=int, nargs='*', default=SIZES)
+    parser.add_argument('--modes', nargs='*', default=MODES)
+    parser.add_argument('--aspects', nargs='*', default=list(ASPECTS.keys()))
+    parser.add_argument('--only', nargs='*', default=None, help='benchmark names to run')
+    args = parser.parse_args()
+
+    warm_up_overlays()  # before the workers are forked, so every case starts with the overlays ready
+
+    results = []
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for name, _ in benchmarks(args.target_size):
+            if args.only and name not in args.only:
+                continue
+            for side in args.sizes:
+                for aspect in args.aspects:
+                    for mode in args.modes:
+                        stats = pool.apply(measure_case, (name, args.target_size, side, aspect, mode,
+                                                          repeat_for(side, args.repeat)))
+                        results.append(stats)
+                        print(f"{name:40} {side:5}px {aspect:5} {mode:4} "
+                              f"{stats['renders_per_sec']:9.1f}/s  p50 {stats['p50_ms']:8.2f} ms  "
+                              f"p99 {stats['p99_ms']:8.2f} ms  rss {stats['peak_rss_mb']:7.1f} MB "
+                              f"(+{stats['rss_growth_mb']:.1f})")
+
+    report = {
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'machine': platform.machine(),
+        'target_size': args.target_size,
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved {len(results)} results to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
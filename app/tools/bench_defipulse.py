@@ -0,0 +1,109 @@
+"""
+Benchmark of the DeFi Pulse GetProjects parsing: whole document vs the streaming early-exit scanner.
+Run it from the "app" dir:
+
+    python tools/bench_defipulse.py --scale 1 10 100 --out ../bench_defipulse.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs.defipulse_job import DefiPulseFetcher, DefiPulseKeeper
+
+EXAMPLE_PATH = './data/GetProjects_example_defipulse.json'
+CHUNK_SIZE = 64 * 1024
+
+
+def scaled_payload(scale, alpha_at):
+    with open(EXAMPLE_PATH, 'r') as f:
+        projects = json.load(f)
+    alpha = next(p for p in projects if p['name'] == DefiPulseFetcher.ALPHA_NAME)
+    others = [p for p in projects if p is not alpha]
+
+    items = []
+    for i in range(scale):
+        for p in others:
+            items.append(dict(p, name=f"{p['name']} #{i}" if i else p['name']))
+    position = {'start': 0, 'original': projects.index(alpha), 'end': len(items)}[alpha_at]
+    items.insert(position, alpha)
+    return json.dumps(items).encode('utf-8')
+
+
+def parse_full(payload: bytes):
+    return DefiPulseKeeper.find_alpha(DefiPulseFetcher.parse_defipulse(json.loads(payload)))
+
+
+def parse_stream(payload: bytes):
+    async def chunks():
+        for i in range(0, len(payload), CHUNK_SIZE):
+            yield payload[i:i + CHUNK_SIZE]
+
+    async def run():
+        stream = DefiPulseFetcher.parse_defipulse_stream(chunks(), {DefiPulseFetcher.ALPHA_NAME})
+        return DefiPulseKeeper.find_alpha([e async for e in stream])
+
+    return asyncio.get_event_loop().run_until_complete(run())
+
+
+def measure(func, payload, repeat):
+    latencies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(payload)
+        latencies.append(time.perf_counter() - t0)
+    assert result is not None and result.name == DefiPulseFetcher.ALPHA_NAME
+
+    tracemalloc.start()
+    func(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'runs': repeat,
+        'p50_ms': latencies[len(latencies) // 2] * 1000.0,
+        'min_ms': latencies[0] * 1000.0,
+        'peak_alloc_kb': peak / 1024.0,
+        'rank': result.rank,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DeFi Pulse parsing benchmark')
+    parser.add_argument('--out', default='bench_defipulse.json', help='JSON report path')
+    parser.add_argument('--scale', type=int, nargs='*', default=[1, 10, 100], help='copies of the example projects')
+    parser.add_argument('--alpha-at', nargs='*', default=['original', 'end'], choices=['start', 'original', 'end'])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scale:
+        for alpha_at in args.alpha_at:
+            payload = scaled_payload(scale, alpha_at)
+            for name, func in (('full', parse_full), ('stream', parse_stream)):
+                stats = measure(func, payload, args.repeat)
+                stats.update(bench=name, scale=scale, alpha_at=alpha_at, payload_kb=len(payload) / 1024.0)
+                results.append(stats)
+                print(f"{name:7} x{scale:<4} alpha@{alpha_at:8} {stats['payload_kb']:9.0f} KB  "
+                      f"p50 {stats['p50_ms']:9.2f} ms  peak {stats['peak_alloc_kb']:9.0f} KB  rank #{stats['rank']}")
+
+    report = {
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved {len(results)} results to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
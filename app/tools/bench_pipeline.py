@@ -0,0 +1,207 @@
+"""
+The whole fetch -> handle -> broadcast pipeline without Telegram: the bot is replaced by a stub that only
+counts the messages. The fetchers run under the JobScheduler with their periods divided by --time-scale,
+and so are the price refresh periods, the HTTP cache TTL and the per-host rate limits.
+Redis from the environment is used (REDIS_HOST, REDIS_PORT), use a separate instance for it.
+Run it from the "app" dir.
+
+Record the live APIs:
+
+    python tools/bench_pipeline.py --config ../config.yaml --record ../recordings --duration 600
+
+Replay them (see tools/replay_server.py):
+
+    python tools/bench_pipeline.py --config ../config.yaml --server http://127.0.0.1:8765 \\
+        --time-scale 60 --duration 60 --out ../bench_pipeline.json
+
+Notification cooldowns are kept in Redis in real time, so they are not accelerated.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+from prodict import Prodict
+
+from jobs.base import INotified
+from jobs.charts import ChartKeeper
+from jobs.defipulse_job import DefiPulseFetcher, DefiPulseKeeper
+from jobs.price_job import PriceFetcher, PriceHandler
+from jobs.scheduler import JobScheduler
+from lib.broadcast import Broadcaster
+from lib.config import Config
+from lib.db import DB
+from lib.depcont import DepContainer
+from lib.http import HttpClient
+from lib.http_record import HttpRecorder
+from localization import LocalizationManager
+
+API_HOSTS = (
+    urlparse(PriceFetcher.COIN_PRICE_GECKO).hostname,
+    urlparse(DefiPulseFetcher.URL_DEFI_PULSE_PROJECTS).hostname,
+)
+
+
+class OfflineBot:
+    """
+    Takes the place of aiogram's Bot for the Broadcaster
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = Counter()
+        self._ids = itertools.count(1)
+
+    async def _send(self, kind):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent[kind] += 1
+        message_id = next(self._ids)
+        return Prodict(message_id=message_id, photo=[Prodict(file_id=f'photo-{message_id}')])
+
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        return await self._send('text')
+
+    async def send_sticker(self, chat_id, sticker, *args, **kwargs):
+        return await self._send('sticker')
+
+    async def send_photo(self, chat_id, photo, *args, **kwargs):
+        return await self._send('photo')
+
+
+class TimedDelegate(INotified):
+    def __init__(self, delegate: INotified, timings: dict):
+        self.delegate = delegate
+        self.timings = timings
+
+    async def on_data(self, sender, data):
+        t0 = time.perf_counter()
+        try:
+            await self.delegate.on_data(sender, data)
+        finally:
+            self.timings[self.delegate.__class__.__name__].append(time.perf_counter() - t0)
+
+    async def on_error(self, sender, e):
+        await self.delegate.on_error(sender, e)
+
+
+def summary(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': values[len(values) // 2] * 1000.0,
+        'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))] * 1000.0,
+        'max_ms': values[-1] * 1000.0,
+    }
+
+
+def accelerate_http(http: HttpClient, time_scale):
+    """
+    The response cache and the per-host rate limits run on the same accelerated time as the fetchers,
+    otherwise the cache answers nearly every fetch and the real quotas throttle the rest
+    """
+    http.cache_ttl /= time_scale
+    http.rate_limits = {
+        host: dict(limit, per_minute=float(limit.get('per_minute', 60)) * time_scale)
+        for host, limit in http.rate_limits.items()
+    }
+
+
+async def run_pipeline(args):
+    d = DepContainer()
+    d.cfg = Config(args.config)
+    d.loop = asyncio.get_event_loop()
+    d.db = DB(d.loop)
+    d.bot = OfflineBot(args.bot_latency)
+    d.loc_man = LocalizationManager()
+    d.broadcaster = Broadcaster(d)
+    d.charts = ChartKeeper(d)
+    d.session = aiohttp.ClientSession()
+    d.http = HttpClient.from_config(d.session, d.cfg)
+    if args.server:
+        d.http.rewrites = {f'https://{host}': f"{args.server.rstrip('/')}/{host}" for host in API_HOSTS}
+    accelerate_http(d.http, args.time_scale)
+    if args.record:
+        d.http.recorder = HttpRecorder(args.record)
+
+    timings = defaultdict(list)
+    defipulse_fetcher = DefiPulseFetcher(d)
+    d.defipulse = DefiPulseKeeper(d)
+    defipulse_fetcher.subscribe(TimedDelegate(d.defipulse, timings))
+    price_fetcher = PriceFetcher(d)
+    price_fetcher.refresh_periods = {name: period / args.time_scale
+                                     for name, period in price_fetcher.refresh_periods.items()}
+    price_fetcher.subscribe(TimedDelegate(PriceHandler(d), timings))
+
+    scheduler = JobScheduler.from_config(d.cfg)
+    for fetcher in [defipulse_fetcher, price_fetcher]:
+        scheduler.add(fetcher, period=fetcher.sleep_period / args.time_scale, startup_delay=0.0)
+        fetch = fetcher.fetch
+
+        async def timed_fetch(fetch=fetch, name=fetcher.name):
+            t0 = time.perf_counter()
+            try:
+                return await fetch()
+            finally:
+                timings[name].append(time.perf_counter() - t0)
+
+        fetcher.fetch = timed_fetch
+
+    t0 = time.perf_counter()
+    task = asyncio.ensure_future(scheduler.run())
+    await asyncio.sleep(args.duration)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    await d.session.close()
+    if d.db.redis is not None:
+        d.db.redis.close()
+        await d.db.redis.wait_closed()
+
+    return {
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'elapsed_sec': elapsed,
+        'time_scale': args.time_scale,
+        'server': args.server,
+        'stages': {name: summary(values) for name, values in timings.items()},
+        'scheduler': scheduler.report(),
+        'http': {'requests': d.http.requests, 'cache_hits': d.http.cache_hits, 'coalesced': d.http.coalesced,
+                 'recorded': d.http.recorder.saved if d.http.recorder else 0},
+        'telegram': dict(d.bot.sent),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the fetch -> handle -> broadcast pipeline')
+    parser.add_argument('--config', default=Config.DEFAULT)
+    parser.add_argument('--server', help='replay server URL, e.g. http://127.0.0.1:8765; live APIs if not set')
+    parser.add_argument('--record', help='directory to record the API responses to')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='fetch periods are divided by it')
+    parser.add_argument('--duration', type=float, default=30.0, help='sec')
+    parser.add_argument('--bot-latency', type=float, default=0.0, help='sec per sent message')
+    parser.add_argument('--out', default='bench_pipeline.json', help='JSON report path')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.get_event_loop().run_until_complete(run_pipeline(args))
+    print(json.dumps(report, indent=2))
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Local stand-in for CoinGecko and DeFi Pulse that replays the responses recorded by HttpClient
+(set http.record_dir in the config, or run tools/bench_pipeline.py --record DIR against the live APIs).
+Run it from the "app" dir:
+
+    python tools/replay_server.py ../recordings --port 8765 --latency 0.2 --jitter 0.1 --errors 0.05 --rate-limits 0.05
+
+then point the bot at it in the config:
+
+    http:
+      rewrite:
+        https://api.coingecko.com: http://127.0.0.1:8765/api.coingecko.com
+        https://data-api.defipulse.com: http://127.0.0.1:8765/data-api.defipulse.com
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+from lib.http_record import ReplayServer, load_recordings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay server of the recorded API responses')
+    parser.add_argument('directory', help='recordings of HttpRecorder')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='sec')
+    parser.add_argument('--jitter', type=float, default=0.0, help='sec, +/- around the latency')
+    parser.add_argument('--errors', type=float, default=0.0, help='rate of 500 answers')
+    parser.add_argument('--rate-limits', type=float, default=0.0, help='rate of 429 answers')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='sec, in the 429 answers')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    recordings = load_recordings(args.directory)
+    for key, items in sorted(recordings.items()):
+        logging.info(f'{len(items):4} x {key}')
+
+    server = ReplayServer(recordings, latency=args.latency, jitter=args.jitter, error_rate=args.errors,
+                          rate_limit_rate=args.rate_limits, retry_after=args.retry_after, seed=args.seed)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()